@@ -1,4 +1,5 @@
-from db import app, db_config
+from db import app
+from db.conexion import conectar
 from flask_cors import cross_origin
 from flask import jsonify, request
 import mysql.connector
@@ -39,7 +40,7 @@ def login():
         password = login_data['password']
 
         # Verificar credenciales en la tabla de usuarios
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
         user_query = """
@@ -138,7 +139,8 @@ def login():
         additional_claims = {
             'user_id': user['ID_Usuario'],
             'user_type': user_type,
-            'role': user['rol_nombre']
+            'role': user['rol_nombre'],
+            'role_id': user['ID_Rol']
         }
         
         access_token = create_access_token(
@@ -1,12 +1,67 @@
-from db import app, db_config
+from db import app
+from db.conexion import conectar
 from flask_cors import cross_origin
-from flask import jsonify, request
+from flask import Response, jsonify, request
 import mysql.connector
+from mysql.connector.constants import ClientFlag
 from flask_jwt_extended import jwt_required
+import json
+
+from datetime import datetime, date
+from db.eventos import broker
+from db.consultas import Consulta, sentencia_update, IGUAL, DESDE, HASTA
+from roles import requiere_rol, ADMIN, MEDICO
+from resumenPaciente import ajustar_citas
+from estadisticas import invalidar_estadisticas
+
+# Segundos entre comentarios keep-alive del stream SSE
+SSE_KEEPALIVE = 15
+
+FILTROS_CITA = {
+    'desde': ('c.Fecha', DESDE),
+    'hasta': ('c.Fecha', HASTA),
+    'estado': ('c.Estado', IGUAL)
+}
+ORDENES_CITA = {
+    'fecha': [('c.Fecha', 'Fecha'), ('c.Hora', 'Hora'), ('c.ID_Cita', 'ID_Cita')]
+}
+
+# Campos del JSON de una cita y su columna en la tabla Cita
+CAMPOS_CITA = {
+    'fecha': 'Fecha',
+    'hora': 'Hora',
+    'id_paciente': 'ID_Paciente',
+    'id_medico': 'ID_Médico',
+    'estado': 'Estado'
+}
+
+
+def publicar_evento_cita(tipo, medico_id, cita):
+    """Notifica a los suscriptores SSE del médico. Nunca falla la petición."""
+    try:
+        broker.publicar(f'medico:{medico_id}', {'tipo': tipo, 'cita': cita})
+    except Exception as e:
+        app.logger.warning(f"Could not publish {tipo} event for doctor {medico_id}: {e}")
+
+
+def filtrar_citas(consulta, args):
+    """Aplica desde/hasta/estado de la query string a una Consulta sobre Cita (alias c).
+
+    Sin `desde` solo se devuelven las citas a partir de hoy, aunque se envíe
+    `hasta`, de modo que la consulta recorre la ventana pedida y no todo el
+    historial. Retorna los filtros aplicados o lanza ValueError si una fecha es inválida.
+    """
+    args = args.to_dict() if hasattr(args, 'to_dict') else dict(args)
+    if not args.get('desde'):
+        args['desde'] = date.today().strftime('%Y-%m-%d')
+
+    # Rangos semiabiertos sobre c.Fecha para aprovechar el índice (ID_Médico, Fecha)
+    consulta.filtrar(args, FILTROS_CITA)
+    return {campo: args.get(campo) for campo in FILTROS_CITA}
 
-from datetime import datetime
 
 @app.route('/citas', methods=['POST'])
+@jwt_required()
 @cross_origin()
 def create_cita():
     cursor = None
@@ -46,7 +101,7 @@ def create_cita():
         except ValueError as e:
             return jsonify({'error': f'Invalid date/time format: {str(e)}'}), 400
         
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
         
         # Check patient exists
@@ -67,17 +122,22 @@ def create_cita():
         """
         
         cursor.execute(query, (data['fecha'], data['hora'], id_paciente, id_medico, estado))
+        cita_id = cursor.lastrowid
+        ajustar_citas(cursor, id_paciente, 1)
+        invalidar_estadisticas(cursor, id_medico, data['fecha'])
         connection.commit()
         
-        return jsonify({
-            'success': True,
-            'id': cursor.lastrowid,
+        cita = {
+            'id': cita_id,
             'fecha': data['fecha'],
             'hora': data['hora'],
             'id_paciente': id_paciente,
             'id_medico': id_medico,
             'estado': estado
-        }), 201
+        }
+        publicar_evento_cita('create', id_medico, cita)
+        
+        return jsonify({'success': True, **cita}), 201
         
     except mysql.connector.Error as error:
         app.logger.error(f"Database error: {str(error)}")
@@ -93,26 +153,14 @@ def create_cita():
 
 
 @app.route('/citas/medico/<int:medico_id>', methods=['GET'])
+@jwt_required()
 @cross_origin()
 def get_citas_by_medico(medico_id):
     app.logger.info(f"Received request for doctor ID: {medico_id}")
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor(dictionary=True)
-        
-        app.logger.info("Checking if doctor exists...")
-        cursor.execute("SELECT ID_Médico, Nombre FROM Médico WHERE ID_Médico = %s", (medico_id,))
-        doctor = cursor.fetchone()
-        
-        if not doctor:
-            app.logger.warning(f"Doctor {medico_id} not found")
-            return jsonify({'error': 'Doctor not found'}), 404
-        
-        app.logger.info(f"Doctor found: {doctor['Nombre']}")
-        
-        query = """
+        consulta = Consulta("""
         SELECT 
             c.ID_Cita,
             c.Fecha,
@@ -127,12 +175,31 @@ def get_citas_by_medico(medico_id):
         FROM Cita c
         JOIN Paciente p ON c.ID_Paciente = p.ID_Paciente
         JOIN Médico m ON c.ID_Médico = m.ID_Médico
-        WHERE c.ID_Médico = %s
-        ORDER BY c.Fecha, c.Hora
-        """
-        app.logger.info("Fetching appointments...")
-        cursor.execute(query, (medico_id,))
-        citas = cursor.fetchall()
+        """)
+        consulta.donde("c.ID_Médico = %s", medico_id)
+        try:
+            filtros = filtrar_citas(consulta, request.args)
+            consulta.ordenar(request.args.get('orden'), ORDENES_CITA, 'fecha')
+            consulta.paginar(request.args.get('limite'), request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+        
+        app.logger.info("Checking if doctor exists...")
+        cursor.execute("SELECT ID_Médico, Nombre FROM Médico WHERE ID_Médico = %s", (medico_id,))
+        doctor = cursor.fetchone()
+        
+        if not doctor:
+            app.logger.warning(f"Doctor {medico_id} not found")
+            return jsonify({'error': 'Doctor not found'}), 404
+        
+        app.logger.info(f"Doctor found: {doctor['Nombre']}")
+        
+        app.logger.info(f"Fetching appointments with filters: {filtros}")
+        cursor.execute(*consulta.sql())
+        citas, siguiente_cursor = consulta.paginar_resultado(cursor.fetchall())
         
         app.logger.info(f"Found {len(citas)} appointments")
         
@@ -147,7 +214,9 @@ def get_citas_by_medico(medico_id):
             'success': True,
             'citas': citas,
             'total': len(citas),
-            'medico': doctor
+            'medico': doctor,
+            'filtros': filtros,
+            'siguiente_cursor': siguiente_cursor
         })
         
     except mysql.connector.Error as error:
@@ -165,6 +234,7 @@ def get_citas_by_medico(medico_id):
 
 
 @app.route('/citas/<int:cita_id>', methods=['DELETE'])
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def delete_cita(cita_id):
     cursor = None
@@ -172,12 +242,13 @@ def delete_cita(cita_id):
     try:
         app.logger.info(f"Received request to delete appointment ID: {cita_id}")
         
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
         # First verify the appointment exists
-        cursor.execute("SELECT ID_Cita FROM Cita WHERE ID_Cita = %s", (cita_id,))
-        if not cursor.fetchone():
+        cursor.execute("SELECT ID_Cita, ID_Paciente, ID_Médico, Fecha FROM Cita WHERE ID_Cita = %s", (cita_id,))
+        existente = cursor.fetchone()
+        if not existente:
             app.logger.warning(f"Appointment {cita_id} not found")
             return jsonify({
                 'success': False,
@@ -187,7 +258,10 @@ def delete_cita(cita_id):
         # Delete the appointment
         delete_query = "DELETE FROM Cita WHERE ID_Cita = %s"
         cursor.execute(delete_query, (cita_id,))
+        ajustar_citas(cursor, existente['ID_Paciente'], -1)
+        invalidar_estadisticas(cursor, existente['ID_Médico'], existente['Fecha'])
         connection.commit()
+        publicar_evento_cita('delete', existente['ID_Médico'], {'id': cita_id})
         
         app.logger.info(f"Successfully deleted appointment {cita_id}")
         return jsonify({
@@ -216,15 +290,32 @@ def delete_cita(cita_id):
             cursor.close()
         if connection:
             connection.close()
-            
-@app.route('/citas/<int:cita_id>', methods=['PUT'])
+
+
+def _campos_modificados(actual, cambios):
+    """Campos de `cambios` cuyo valor difiere de la fila `actual` de Cita."""
+    def normalizar(campo, valor):
+        if campo == 'fecha':
+            return str(valor)[:10]
+        if campo == 'hora':
+            # TIME llega como timedelta ('9:00:00'); el JSON puede traer '09:00:00'
+            return str(valor).zfill(8)
+        return valor
+    return {
+        campo for campo, valor in cambios.items()
+        if normalizar(campo, valor) != normalizar(campo, actual[CAMPOS_CITA[campo]])
+    }
+
+
+@app.route('/citas/<int:cita_id>', methods=['PUT', 'PATCH'])
+@jwt_required()
 @cross_origin()
 def update_cita(cita_id):
     cursor = None
     connection = None
     try:
-        app.logger.info(f"Received request to update appointment ID: {cita_id}")
-        data = request.get_json()
+        app.logger.info(f"Received {request.method} request to update appointment ID: {cita_id}")
+        data = request.get_json(silent=True)
         
         if not data:
             app.logger.error("No data provided in request")
@@ -233,97 +324,153 @@ def update_cita(cita_id):
                 'error': 'No data provided'
             }), 400
             
-        # Validate required fields
-        required_fields = ['fecha', 'hora', 'id_paciente', 'id_medico', 'estado']
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            app.logger.error(f"Missing required fields: {missing_fields}")
+        # PUT reemplaza la cita completa; PATCH acepta cualquier subconjunto de campos
+        if request.method == 'PUT':
+            missing_fields = [field for field in CAMPOS_CITA if field not in data]
+            if missing_fields:
+                app.logger.error(f"Missing required fields: {missing_fields}")
+                return jsonify({
+                    'success': False,
+                    'error': f'Missing required fields: {", ".join(missing_fields)}'
+                }), 400
+        
+        cambios = {field: data[field] for field in CAMPOS_CITA if field in data}
+        if not cambios:
+            return jsonify({
+                'success': False,
+                'error': f'No valid fields provided. Allowed: {", ".join(CAMPOS_CITA)}'
+            }), 400
+        
+        try:
+            for field in ('id_paciente', 'id_medico'):
+                if field in cambios:
+                    cambios[field] = int(cambios[field])
+            if 'fecha' in cambios:
+                datetime.strptime(cambios['fecha'], '%Y-%m-%d')
+            if 'hora' in cambios:
+                datetime.strptime(cambios['hora'], '%H:%M:%S')
+        except (ValueError, TypeError) as e:
             return jsonify({
                 'success': False,
-                'error': f'Missing required fields: {", ".join(missing_fields)}'
+                'error': f'Invalid field format: {str(e)}'
             }), 400
         
-        connection = mysql.connector.connect(**db_config)
+        minimal = 'return=minimal' in request.headers.get('Prefer', '').replace(' ', '')
+        
+        # FOUND_ROWS: rowcount cuenta filas encontradas aunque los valores no cambien
+        connection = conectar(client_flags=[ClientFlag.FOUND_ROWS])
         cursor = connection.cursor(dictionary=True)
         
-        # Verify appointment exists
-        cursor.execute("SELECT ID_Cita FROM Cita WHERE ID_Cita = %s", (cita_id,))
-        if not cursor.fetchone():
+        # Una sola consulta: la cita actual y la existencia de las claves foráneas nuevas
+        columnas = ["c.ID_Cita", "c.Fecha", "c.Hora", "c.Estado", "c.ID_Paciente", "c.ID_Médico"]
+        params = []
+        if 'id_paciente' in cambios:
+            columnas.append("EXISTS(SELECT 1 FROM Paciente WHERE ID_Paciente = %s) AS paciente_existe")
+            params.append(cambios['id_paciente'])
+        if 'id_medico' in cambios:
+            columnas.append("EXISTS(SELECT 1 FROM Médico WHERE ID_Médico = %s) AS medico_existe")
+            params.append(cambios['id_medico'])
+        params.append(cita_id)
+        
+        cursor.execute(f"""
+        SELECT {', '.join(columnas)}
+        FROM Cita c
+        WHERE c.ID_Cita = %s
+        """, params)
+        actual = cursor.fetchone()
+        
+        if not actual:
             app.logger.warning(f"Appointment {cita_id} not found")
             return jsonify({
                 'success': False,
                 'error': f'Appointment with ID {cita_id} not found'
             }), 404
-        
-        # Verify patient exists
-        cursor.execute("SELECT 1 FROM Paciente WHERE ID_Paciente = %s", (data['id_paciente'],))
-        if not cursor.fetchone():
+        if not actual.get('paciente_existe', 1):
             return jsonify({
                 'success': False,
                 'error': 'Patient not found'
             }), 404
-            
-        # Verify doctor exists
-        cursor.execute("SELECT 1 FROM Médico WHERE ID_Médico = %s", (data['id_medico'],))
-        if not cursor.fetchone():
+        if not actual.get('medico_existe', 1):
             return jsonify({
                 'success': False,
                 'error': 'Doctor not found'
             }), 404
         
-        # Update appointment
-        update_query = """
-        UPDATE Cita 
-        SET Fecha = %s,
-            Hora = %s,
-            ID_Paciente = %s,
-            ID_Médico = %s,
-            Estado = %s
-        WHERE ID_Cita = %s
-        """
-        values = (
-            data['fecha'],
-            data['hora'],
-            data['id_paciente'],
-            data['id_medico'],
-            data['estado'],
-            cita_id
-        )
-        
-        cursor.execute(update_query, values)
-        connection.commit()
+        cursor.execute(*sentencia_update('Cita', CAMPOS_CITA, cambios, 'ID_Cita', cita_id))
         
-  
-        cursor.execute("""
-        SELECT 
-            c.ID_Cita,
-            c.Fecha,
-            c.Hora,
-            c.Estado,
-            p.Nombre as nombre_paciente,
-            p.Teléfono as telefono_paciente,
-            m.Nombre as nombre_medico,
-            m.Especialidad
-        FROM Cita c
-        JOIN Paciente p ON c.ID_Paciente = p.ID_Paciente
-        JOIN Médico m ON c.ID_Médico = m.ID_Médico
-        WHERE c.ID_Cita = %s
-        """, (cita_id,))
+        if cursor.rowcount == 0:
+            # Borrada entre la lectura y el UPDATE
+            connection.rollback()
+            return jsonify({
+                'success': False,
+                'error': f'Appointment with ID {cita_id} not found'
+            }), 404
+        
+        # El resumen y las estadísticas solo se tocan si el cambio los afecta: la próxima
+        # cita depende de fecha, hora, paciente y de si la cita está cancelada
+        modificados = _campos_modificados(actual, cambios)
+        paciente_anterior = actual['ID_Paciente']
+        cancelacion = 'estado' in modificados and 'Cancelada' in (actual['Estado'], cambios['estado'])
+        if 'id_paciente' in modificados:
+            ajustar_citas(cursor, paciente_anterior, -1)
+            ajustar_citas(cursor, cambios['id_paciente'], 1)
+        elif modificados & {'fecha', 'hora'} or cancelacion:
+            ajustar_citas(cursor, paciente_anterior, 0)
+        medico_anterior = actual['ID_Médico']
+        # Las estadísticas cuentan por médico, fecha, hora y estado; no por paciente.
+        # Se invalida el mes anterior y, si la cita se movió, también el nuevo
+        if modificados & {'fecha', 'hora', 'estado', 'id_medico'}:
+            invalidar_estadisticas(cursor, medico_anterior, actual['Fecha'])
+        for field, value in cambios.items():
+            actual[CAMPOS_CITA[field]] = value
+        if modificados & {'fecha', 'id_medico'}:
+            invalidar_estadisticas(cursor, actual['ID_Médico'], actual['Fecha'])
+        connection.commit()
         
-        updated_cita = cursor.fetchone()
+        actual.pop('paciente_existe', None)
+        actual.pop('medico_existe', None)
+        
+        if minimal:
+            # Representación mínima: la fila ya leída más los cambios, sin releer
+            updated_cita = actual
+        else:
+            cursor.execute("""
+            SELECT 
+                c.ID_Cita,
+                c.Fecha,
+                c.Hora,
+                c.Estado,
+                p.Nombre as nombre_paciente,
+                p.Teléfono as telefono_paciente,
+                m.Nombre as nombre_medico,
+                m.Especialidad
+            FROM Cita c
+            JOIN Paciente p ON c.ID_Paciente = p.ID_Paciente
+            JOIN Médico m ON c.ID_Médico = m.ID_Médico
+            WHERE c.ID_Cita = %s
+            """, (cita_id,))
+            updated_cita = cursor.fetchone()
         
         # Format dates
-        if updated_cita['Fecha']:
+        if updated_cita['Fecha'] and not isinstance(updated_cita['Fecha'], str):
             updated_cita['Fecha'] = updated_cita['Fecha'].strftime('%Y-%m-%d')
         if updated_cita['Hora']:
             updated_cita['Hora'] = str(updated_cita['Hora'])
         
+        # Si la cita cambió de médico, para la agenda anterior equivale a un borrado
+        if medico_anterior != actual['ID_Médico']:
+            publicar_evento_cita('delete', medico_anterior, {'id': cita_id})
+        publicar_evento_cita('update', actual['ID_Médico'], updated_cita)
+        
         app.logger.info(f"Successfully updated appointment {cita_id}")
-        return jsonify({
+        response = jsonify({
             'success': True,
             'message': 'Appointment updated successfully',
             'cita': updated_cita
-        }), 200
+        })
+        if minimal:
+            response.headers['Preference-Applied'] = 'return=minimal'
+        return response, 200
         
     except mysql.connector.Error as error:
         app.logger.error(f"Database error updating appointment: {str(error)}")
@@ -348,21 +495,14 @@ def update_cita(cita_id):
 
 
 @app.route('/citas/paciente/<int:paciente_id>', methods=['GET'])
+@jwt_required()
 @cross_origin()
 def get_citas_by_paciente(paciente_id):
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor(dictionary=True)
-        
-        # Verify patient exists
-        cursor.execute("SELECT 1 FROM Paciente WHERE ID_Paciente = %s", (paciente_id,))
-        if not cursor.fetchone():
-            return jsonify({'error': 'Patient not found'}), 404
-        
         # Get appointments with doctor's name
-        query = """
+        consulta = Consulta("""
         SELECT 
             c.ID_Cita,
             c.Fecha,
@@ -373,11 +513,25 @@ def get_citas_by_paciente(paciente_id):
             m.Nombre as nombre_medico
         FROM Cita c
         JOIN Médico m ON c.ID_Médico = m.ID_Médico
-        WHERE c.ID_Paciente = %s
-        ORDER BY c.Fecha DESC, c.Hora DESC
-        """
-        cursor.execute(query, (paciente_id,))
-        citas = cursor.fetchall()
+        """)
+        consulta.donde("c.ID_Paciente = %s", paciente_id)
+        try:
+            filtros = filtrar_citas(consulta, request.args)
+            consulta.ordenar(request.args.get('orden'), ORDENES_CITA, '-fecha')
+            consulta.paginar(request.args.get('limite'), request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+        
+        # Verify patient exists
+        cursor.execute("SELECT 1 FROM Paciente WHERE ID_Paciente = %s", (paciente_id,))
+        if not cursor.fetchone():
+            return jsonify({'error': 'Patient not found'}), 404
+        
+        cursor.execute(*consulta.sql())
+        citas, siguiente_cursor = consulta.paginar_resultado(cursor.fetchall())
         
         # Format the response
         formatted_citas = []
@@ -394,7 +548,9 @@ def get_citas_by_paciente(paciente_id):
         
         return jsonify({
             'success': True,
-            'citas': formatted_citas
+            'citas': formatted_citas,
+            'filtros': filtros,
+            'siguiente_cursor': siguiente_cursor
         })
         
     except mysql.connector.Error as error:
@@ -403,4 +559,49 @@ def get_citas_by_paciente(paciente_id):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
\ No newline at end of file
+            connection.close()
+
+
+@app.route('/citas/medico/<int:medico_id>/eventos', methods=['GET'])
+@requiere_rol(ADMIN, MEDICO, ubicaciones=['headers', 'query_string'])
+@cross_origin()
+def stream_eventos_medico(medico_id):
+    cursor = None
+    connection = None
+    try:
+        connection = conectar()
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 FROM Médico WHERE ID_Médico = %s", (medico_id,))
+        if not cursor.fetchone():
+            return jsonify({'error': 'Doctor not found'}), 404
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error: {str(error)}")
+        return jsonify({'error': 'Database operation failed'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+    # La conexión se cierra antes de suscribirse: el stream no usa la base de datos
+    suscripcion = broker.suscribir(f'medico:{medico_id}')
+    app.logger.info(f"SSE client subscribed to doctor {medico_id}")
+
+    def generar():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                evento = suscripcion.obtener(timeout=SSE_KEEPALIVE)
+                if evento is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                datos = json.dumps(evento['cita'], default=str)
+                yield f"event: {evento['tipo']}\ndata: {datos}\n\n"
+        finally:
+            suscripcion.cerrar()
+            app.logger.info(f"SSE client unsubscribed from doctor {medico_id}")
+
+    response = Response(generar(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
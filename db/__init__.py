@@ -20,6 +20,14 @@ secret_key = os.environ.get('SECRET_KEY')
 app.config['CORS_HEADERS'] = 'Content-Type'
 app.config['JWT_ALGORITHM'] = 'HS256'
 app.config['JWT_SECRET_KEY'] = secret_key 
+# 'fulltext' usa el índice FULLTEXT de MySQL; 'memoria' un índice invertido en proceso (pruebas)
+app.config['BUSQUEDA_DIAGNOSTICOS'] = os.environ.get('BUSQUEDA_DIAGNOSTICOS', 'fulltext')
+# Sin METRICAS_TOKEN, /metrics no pide credenciales y solo debe publicarse en la red interna
+app.config['METRICAS_TOKEN'] = os.environ.get('METRICAS_TOKEN')
+# Sentencias más lentas que esto (ms) van al log; más de SQL_REPETICIONES_MAX
+# sentencias con la misma forma en un request se reportan como posible N+1
+app.config['SQL_LENTA_MS'] = float(os.environ.get('SQL_LENTA_MS', 200))
+app.config['SQL_REPETICIONES_MAX'] = int(os.environ.get('SQL_REPETICIONES_MAX', 10))
 jwt = JWTManager(app)
 
 
@@ -45,4 +53,4 @@ db_config = {
     'password': password
 }
 
-import medicamentos, diagnosticos, roles, medicos, citas, tratamientos, usuarios, auth, historialMedico, paciente
\ No newline at end of file
+import medicamentos, diagnosticos, roles, medicos, citas, tratamientos, usuarios, auth, historialMedico, paciente, resumenPaciente, estadisticas, exportar, monitoreo
\ No newline at end of file
@@ -0,0 +1,165 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+_TOKEN = re.compile(r'\w+')
+
+# Palabras demasiado comunes para aportar a la relevancia
+PALABRAS_VACIAS = {
+    'de', 'la', 'el', 'en', 'y', 'a', 'los', 'las', 'del', 'con', 'por', 'para',
+    'un', 'una', 'se', 'al', 'que', 'sin', 'o'
+}
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos: 'José' -> 'jose'."""
+    texto = unicodedata.normalize('NFKD', str(texto or '').lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def tokenizar(texto):
+    return [t for t in _TOKEN.findall(normalizar(texto)) if t not in PALABRAS_VACIAS]
+
+
+class IndiceInvertido:
+    """Índice invertido en memoria con puntaje TF-IDF.
+
+    Alternativa al índice FULLTEXT de MySQL para entornos de prueba. Cada
+    documento guarda además metadatos arbitrarios para filtrar resultados.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._documentos = {}
+        self.cargado = False
+
+    def agregar(self, doc_id, texto, **meta):
+        frecuencias = Counter(tokenizar(texto))
+        with self._lock:
+            self._quitar(doc_id)
+            for token, frecuencia in frecuencias.items():
+                self._postings.setdefault(token, {})[doc_id] = frecuencia
+            self._documentos[doc_id] = (sum(frecuencias.values()) or 1, meta)
+
+    def cargar(self, documentos):
+        """Reemplaza el contenido con (doc_id, texto, meta) y marca el índice como cargado."""
+        with self._lock:
+            self._postings = {}
+            self._documentos = {}
+        for doc_id, texto, meta in documentos:
+            self.agregar(doc_id, texto, **meta)
+        self.cargado = True
+
+    def _quitar(self, doc_id):
+        if doc_id not in self._documentos:
+            return
+        for token in list(self._postings):
+            documentos = self._postings[token]
+            documentos.pop(doc_id, None)
+            if not documentos:
+                del self._postings[token]
+        del self._documentos[doc_id]
+
+    def buscar(self, consulta, filtro=None):
+        """Devuelve [(doc_id, puntaje)] ordenado por relevancia descendente.
+
+        `filtro` recibe los metadatos de cada documento y decide si se incluye.
+        """
+        tokens = set(tokenizar(consulta))
+        puntajes = Counter()
+        with self._lock:
+            total = len(self._documentos) or 1
+            for token in tokens:
+                documentos = self._postings.get(token, {})
+                if not documentos:
+                    continue
+                idf = math.log(1 + total / len(documentos))
+                for doc_id, frecuencia in documentos.items():
+                    largo, meta = self._documentos[doc_id]
+                    if filtro and not filtro(meta):
+                        continue
+                    puntajes[doc_id] += (frecuencia / largo) * idf
+        return sorted(puntajes.items(), key=lambda item: (-item[1], -item[0]))
+
+
+class IndicePrefijos:
+    """Autocompletado por prefijo sobre textos completos, ponderado por frecuencia.
+
+    Mantiene las claves normalizadas en una lista ordenada; un prefijo es el
+    rango [bisect(prefijo), bisect(prefijo + '\\uffff')). Los resultados por
+    prefijo se guardan en caché y se invalidan al agregar un texto que empieza
+    con ese prefijo.
+    """
+
+    MAX_CACHE = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claves = []
+        self._entradas = {}
+        self._cache = {}
+        self.cargado = False
+
+    @staticmethod
+    def _clave(texto):
+        return ' '.join(normalizar(texto).split())
+
+    def _sumar(self, texto, cantidad):
+        clave = self._clave(texto)
+        if not clave:
+            return
+        entrada = self._entradas.get(clave)
+        if entrada:
+            entrada[1] += cantidad
+        else:
+            self._entradas[clave] = [' '.join(str(texto).split()), cantidad]
+            bisect.insort(self._claves, clave)
+        for i in range(1, len(clave) + 1):
+            self._cache.pop(clave[:i], None)
+
+    def agregar(self, texto, cantidad=1):
+        with self._lock:
+            self._sumar(texto, cantidad)
+
+    def cargar(self, textos):
+        """Reemplaza el contenido con pares (texto, frecuencia)."""
+        with self._lock:
+            self._claves = []
+            self._entradas = {}
+            self._cache = {}
+            for texto, cantidad in textos:
+                clave = self._clave(texto)
+                if not clave:
+                    continue
+                if clave in self._entradas:
+                    self._entradas[clave][1] += cantidad
+                else:
+                    self._entradas[clave] = [' '.join(str(texto).split()), cantidad]
+            self._claves = sorted(self._entradas)
+            self.cargado = True
+
+    def sugerir(self, prefijo, limite=10):
+        """Devuelve [(texto, frecuencia)] de los textos que empiezan con `prefijo`."""
+        prefijo = self._clave(prefijo)
+        if not prefijo or limite < 1:
+            return []
+        with self._lock:
+            calculado, resultado = self._cache.get(prefijo, (0, None))
+            if resultado is None or calculado < limite:
+                inicio = bisect.bisect_left(self._claves, prefijo)
+                fin = bisect.bisect_left(self._claves, prefijo + '\uffff', inicio)
+                calculado = max(limite, 10)
+                mejores = heapq.nlargest(
+                    calculado, self._claves[inicio:fin],
+                    key=lambda clave: self._entradas[clave][1]
+                )
+                resultado = [tuple(self._entradas[clave]) for clave in mejores]
+                if len(self._cache) >= self.MAX_CACHE:
+                    self._cache.clear()
+                self._cache[prefijo] = (calculado, resultado)
+        return resultado[:limite]
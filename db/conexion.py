@@ -0,0 +1,46 @@
+import time
+import mysql.connector
+from db import db_config
+from db.instrumentacion import instrumentar
+from db.metricas import metricas
+
+
+class Conexion:
+    """Conexión MySQL que descuenta el gauge de conexiones abiertas al cerrarse.
+
+    Los cursores se envuelven para anotar sus sentencias en el request en
+    curso; todo lo demás (commit, rollback, ...) se delega en la conexión real.
+    """
+
+    def __init__(self, conexion):
+        self._conexion = conexion
+        self._abierta = True
+
+    def __getattr__(self, nombre):
+        return getattr(self._conexion, nombre)
+
+    def cursor(self, *args, **kwargs):
+        return instrumentar(self._conexion.cursor(*args, **kwargs))
+
+    def close(self):
+        try:
+            self._conexion.close()
+        finally:
+            if self._abierta:
+                self._abierta = False
+                metricas.sumar_gauge('db_connections_open', delta=-1)
+
+
+def conectar(**opciones):
+    """Abre una conexión con db_config (más `opciones`) y registra sus métricas."""
+    inicio = time.perf_counter()
+    try:
+        conexion = mysql.connector.connect(**db_config, **opciones)
+    except mysql.connector.Error:
+        metricas.incrementar('db_connection_errors_total')
+        raise
+    finally:
+        metricas.observar('db_connect_duration_seconds', '', time.perf_counter() - inicio)
+    metricas.incrementar('db_connections_total')
+    metricas.sumar_gauge('db_connections_open')
+    return Conexion(conexion)
@@ -0,0 +1,191 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+# Tipos de filtro soportados por Consulta.filtrar
+IGUAL = 'igual'
+ENTERO = 'entero'
+FECHA = 'fecha'        # un día completo: [fecha, fecha + 1 día)
+DESDE = 'desde'        # columna >= fecha
+HASTA = 'hasta'        # columna < fecha + 1 día (hasta inclusive)
+PREFIJO = 'prefijo'    # LIKE 'valor%', usa el índice de la columna
+
+
+def _fecha(valor):
+    return datetime.strptime(valor, '%Y-%m-%d').date()
+
+
+def _escapar_like(valor):
+    return valor.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def codificar_cursor(valores):
+    datos = json.dumps(valores, default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(datos).decode('ascii')
+
+
+def decodificar_cursor(cursor):
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('cursor inválido')
+    # Un JSON válido que no es la lista de valores del orden (MQ== es 1) también se rechaza
+    if not isinstance(valores, list) or any(isinstance(v, (list, dict)) for v in valores):
+        raise ValueError('cursor inválido')
+    return valores
+
+
+class Consulta:
+    """Arma un SELECT con filtros, orden y paginación keyset sin concatenar valores.
+
+    Los nombres de columna solo salen de los diccionarios de filtros y órdenes
+    definidos en el código; los valores del cliente siempre van como parámetros.
+
+        consulta = Consulta("SELECT ... FROM Diagnóstico d JOIN ...")
+        consulta.filtrar(request.args, {'fecha': ('d.Fecha', FECHA)})
+        consulta.ordenar(request.args.get('orden'), {'fecha': [('d.Fecha', 'Fecha')]}, '-fecha')
+        consulta.paginar(request.args.get('limite'), request.args.get('cursor'))
+        cursor.execute(*consulta.sql())
+    """
+
+    def __init__(self, select, *params):
+        self._select = select
+        self._condiciones = []
+        # Parámetros del SELECT (si los tiene) seguidos de los de WHERE
+        self._params = list(params)
+        self._agrupar = None
+        self._agregados = ()
+        self._having = []
+        self._params_having = []
+        self._orden = []
+        self._descendente = False
+        self._limite = None
+
+    def donde(self, condicion, *params):
+        self._condiciones.append(condicion)
+        self._params.extend(params)
+        return self
+
+    def agrupar(self, columnas, agregados=()):
+        """Agrega GROUP BY. Llamar antes de paginar.
+
+        `agregados` son los alias del SELECT calculados con funciones de agregación:
+        un keyset que ordena por alguno va a HAVING; si no, va a WHERE y filtra
+        antes de agrupar.
+        """
+        self._agrupar = columnas
+        self._agregados = tuple(agregados)
+        return self
+
+    def filtrar(self, args, permitidos):
+        """Aplica los filtros de `args` presentes en `permitidos` ({param: (columna, tipo)}).
+
+        Lanza ValueError si un valor no tiene el formato del tipo.
+        """
+        for param, (columna, tipo) in permitidos.items():
+            valor = args.get(param)
+            if valor is None or valor == '':
+                continue
+            try:
+                if tipo == ENTERO:
+                    self.donde(f"{columna} = %s", int(valor))
+                elif tipo == FECHA:
+                    dia = _fecha(valor)
+                    self.donde(f"{columna} >= %s AND {columna} < %s", dia, dia + timedelta(days=1))
+                elif tipo == DESDE:
+                    self.donde(f"{columna} >= %s", _fecha(valor))
+                elif tipo == HASTA:
+                    self.donde(f"{columna} < %s", _fecha(valor) + timedelta(days=1))
+                elif tipo == PREFIJO:
+                    self.donde(f"{columna} LIKE %s", _escapar_like(valor) + '%')
+                else:
+                    self.donde(f"{columna} = %s", valor)
+            except ValueError:
+                raise ValueError(f"Valor inválido para '{param}': {valor}")
+        return self
+
+    def ordenar(self, orden, permitidos, por_defecto):
+        """`orden` es una clave de `permitidos`, con '-' delante para descendente.
+
+        Cada opción es una lista de (columna, clave_en_fila) que debe terminar en
+        una columna única para que la paginación keyset sea estable.
+        """
+        orden = orden or por_defecto
+        self._descendente = orden.startswith('-')
+        clave = orden.lstrip('-')
+        if clave not in permitidos:
+            raise ValueError(f"Orden no permitido: {clave}. Opciones: {', '.join(permitidos)}")
+        self._orden = permitidos[clave]
+        return self
+
+    def paginar(self, limite, cursor=None, limite_max=200):
+        """Limita a `limite` filas y continúa después del `cursor` recibido."""
+        if limite is None and cursor is None:
+            return self
+        try:
+            self._limite = min(int(limite or limite_max), limite_max)
+        except ValueError:
+            raise ValueError(f"Valor inválido para 'limite': {limite}")
+        if self._limite < 1:
+            raise ValueError("'limite' debe ser positivo")
+        if cursor:
+            valores = decodificar_cursor(cursor)
+            if len(valores) != len(self._orden):
+                raise ValueError('cursor inválido')
+            self._condicion_keyset(valores)
+        return self
+
+    def _condicion_keyset(self, valores):
+        # (a, b) < (x, y)  ->  a < x OR (a = x AND b < y), forma que MySQL resuelve con el índice
+        operador = '<' if self._descendente else '>'
+        alternativas = []
+        params = []
+        for i, (columna, _) in enumerate(self._orden):
+            partes = [f"{c} = %s" for c, _ in self._orden[:i]] + [f"{columna} {operador} %s"]
+            alternativas.append('(' + ' AND '.join(partes) + ')')
+            params.extend(valores[:i] + [valores[i]])
+        condicion = '(' + ' OR '.join(alternativas) + ')'
+        if any(columna in self._agregados for columna, _ in self._orden):
+            self._having.append(condicion)
+            self._params_having.extend(params)
+        else:
+            self.donde(condicion, *params)
+
+    def sql(self):
+        sql = self._select
+        if self._condiciones:
+            sql += "\nWHERE " + "\nAND ".join(self._condiciones)
+        if self._agrupar:
+            sql += "\nGROUP BY " + self._agrupar
+        if self._having:
+            sql += "\nHAVING " + "\nAND ".join(self._having)
+        if self._orden:
+            direccion = ' DESC' if self._descendente else ''
+            sql += "\nORDER BY " + ', '.join(columna + direccion for columna, _ in self._orden)
+        params = list(self._params) + self._params_having
+        if self._limite:
+            # Una fila extra indica si hay otra página
+            sql += "\nLIMIT %s"
+            params.append(self._limite + 1)
+        return sql, params
+
+    def paginar_resultado(self, filas):
+        """Recorta la fila extra y devuelve (filas, siguiente_cursor)."""
+        if not self._limite or len(filas) <= self._limite:
+            return filas, None
+        filas = filas[:self._limite]
+        ultima = filas[-1]
+        return filas, codificar_cursor([ultima[clave] for _, clave in self._orden])
+
+
+def sentencia_update(tabla, campos, datos, columna_id, valor_id):
+    """Arma un UPDATE con los campos de `datos` presentes en `campos` ({clave_json: columna}).
+
+    Devuelve (sql, params) o None si `datos` no trae ningún campo actualizable.
+    """
+    columnas = [(columna, datos[clave]) for clave, columna in campos.items() if clave in datos]
+    if not columnas:
+        return None
+    set_clause = ', '.join(f"{columna} = %s" for columna, _ in columnas)
+    params = [valor for _, valor in columnas] + [valor_id]
+    return f"UPDATE {tabla} SET {set_clause} WHERE {columna_id} = %s", params
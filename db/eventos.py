@@ -0,0 +1,97 @@
+import json
+import os
+import queue
+import threading
+
+
+class Suscripcion:
+    """Cola de eventos de un suscriptor del broker en memoria."""
+
+    def __init__(self, broker, canal, cola):
+        self._broker = broker
+        self.canal = canal
+        self._cola = cola
+
+    def obtener(self, timeout=None):
+        """Devuelve el siguiente evento o None si vence el timeout."""
+        try:
+            return self._cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def cerrar(self):
+        self._broker._cancelar(self.canal, self._cola)
+
+
+class BrokerMemoria:
+    """Pub/sub dentro del proceso. Solo alcanza a los clientes del mismo worker."""
+
+    def __init__(self, max_pendientes=100):
+        self._lock = threading.Lock()
+        self._suscriptores = {}
+        self._max_pendientes = max_pendientes
+
+    def publicar(self, canal, evento):
+        with self._lock:
+            colas = list(self._suscriptores.get(canal, ()))
+        for cola in colas:
+            try:
+                cola.put_nowait(evento)
+            except queue.Full:
+                # Un cliente lento no debe bloquear al que publica
+                pass
+
+    def suscribir(self, canal):
+        cola = queue.Queue(maxsize=self._max_pendientes)
+        with self._lock:
+            self._suscriptores.setdefault(canal, set()).add(cola)
+        return Suscripcion(self, canal, cola)
+
+    def _cancelar(self, canal, cola):
+        with self._lock:
+            colas = self._suscriptores.get(canal)
+            if colas:
+                colas.discard(cola)
+                if not colas:
+                    del self._suscriptores[canal]
+
+
+class SuscripcionRedis:
+    def __init__(self, pubsub, canal):
+        self._pubsub = pubsub
+        self.canal = canal
+
+    def obtener(self, timeout=None):
+        mensaje = self._pubsub.get_message(timeout=timeout)
+        if not mensaje:
+            return None
+        return json.loads(mensaje['data'])
+
+    def cerrar(self):
+        self._pubsub.close()
+
+
+class BrokerRedis:
+    """Pub/sub sobre Redis para despliegues con varios workers (requiere `redis`)."""
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    def publicar(self, canal, evento):
+        self._redis.publish(canal, json.dumps(evento, default=str))
+
+    def suscribir(self, canal):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(canal)
+        return SuscripcionRedis(pubsub, canal)
+
+
+def crear_broker(url=None):
+    """Crea el broker según EVENTOS_BROKER: vacío para memoria, redis://... para Redis."""
+    if url and url.startswith(('redis://', 'rediss://')):
+        return BrokerRedis(url)
+    return BrokerMemoria()
+
+
+broker = crear_broker(os.environ.get('EVENTOS_BROKER'))
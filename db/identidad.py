@@ -0,0 +1,30 @@
+import hashlib
+from datetime import date
+from db.busqueda import normalizar
+
+# Valores de Paciente.Género que aceptan las altas
+GENEROS = ('Masculino', 'Femenino', 'Otro')
+
+
+def clave_identidad(nombre, fecha_nacimiento, telefono):
+    """Hash de (nombre, fecha de nacimiento, teléfono) normalizados.
+
+    'José  Pérez', '1990-01-02', '(555) 123-4567' y 'jose perez', '1990-01-02',
+    '5551234567' dan la misma clave.
+    """
+    nombre = ' '.join(normalizar(nombre).split())
+    if isinstance(fecha_nacimiento, date):
+        fecha = fecha_nacimiento.isoformat()
+    else:
+        fecha = str(fecha_nacimiento or '').strip()[:10]
+    telefono = ''.join(c for c in str(telefono or '') if c.isdigit())
+    return hashlib.sha1(f"{nombre}|{fecha}|{telefono}".encode('utf-8')).hexdigest()
+
+
+def buscar_duplicado(cursor, clave):
+    """Devuelve el ID_Paciente con la misma clave de identidad, o None."""
+    cursor.execute("SELECT ID_Paciente FROM Paciente WHERE Clave_Identidad = %s LIMIT 1", (clave,))
+    fila = cursor.fetchone()
+    if not fila:
+        return None
+    return fila['ID_Paciente'] if isinstance(fila, dict) else fila[0]
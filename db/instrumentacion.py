@@ -0,0 +1,117 @@
+import re
+import time
+from collections import Counter
+from flask import g, has_request_context
+
+_NORMALIZACION = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),
+    (re.compile(r'%\(\w+\)s|%s'), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\s+'), ' '),
+    # IN (?, ?, ...) y VALUES (...), (...) tienen la misma forma sin importar el largo
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*'), '(...)'),
+]
+
+
+def normalizar_sql(sql):
+    """Forma de la sentencia: literales y parámetros como ?, espacios colapsados.
+
+    "SELECT * FROM Cita WHERE ID_Cita = 7" y "... = %s" dan la misma forma, así
+    se pueden contar las sentencias que se repiten dentro de un request.
+    """
+    for patron, reemplazo in _NORMALIZACION:
+        sql = patron.sub(reemplazo, sql)
+    return sql.strip()
+
+
+class CursorInstrumentado:
+    """Cursor que anota cada sentencia (forma, duración, filas) en g.consultas.
+
+    La duración incluye el tiempo de leer las filas: en un cursor sin buffer la
+    consulta se resuelve recién al recorrerlo.
+    """
+
+    def __init__(self, cursor, consultas):
+        self._cursor = cursor
+        self._consultas = consultas
+        self._actual = None
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def _medir(self, funcion):
+        inicio = time.perf_counter()
+        try:
+            return funcion()
+        finally:
+            if self._actual is not None:
+                self._actual['duracion'] += time.perf_counter() - inicio
+
+    def _leidas(self, cantidad):
+        if self._actual is not None:
+            self._actual['leidas'] += cantidad
+
+    def _ejecutar(self, funcion, sql):
+        self._actual = {'sql': normalizar_sql(sql), 'duracion': 0.0, 'afectadas': 0, 'leidas': 0}
+        self._consultas.append(self._actual)
+        resultado = self._medir(funcion)
+        self._actual['afectadas'] = max(self._cursor.rowcount, 0)
+        return resultado
+
+    def execute(self, sql, *args, **kwargs):
+        return self._ejecutar(lambda: self._cursor.execute(sql, *args, **kwargs), sql)
+
+    def executemany(self, sql, *args, **kwargs):
+        return self._ejecutar(lambda: self._cursor.executemany(sql, *args, **kwargs), sql)
+
+    def fetchone(self):
+        fila = self._medir(self._cursor.fetchone)
+        if fila is not None:
+            self._leidas(1)
+        return fila
+
+    def fetchmany(self, *args, **kwargs):
+        filas = self._medir(lambda: self._cursor.fetchmany(*args, **kwargs))
+        self._leidas(len(filas))
+        return filas
+
+    def fetchall(self):
+        filas = self._medir(self._cursor.fetchall)
+        self._leidas(len(filas))
+        return filas
+
+    # Los métodos especiales no pasan por __getattr__: se delegan explícitamente
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        fila = self.fetchone()
+        if fila is None:
+            raise StopIteration
+        return fila
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+
+def instrumentar(cursor):
+    """Envuelve el cursor si hay un request en curso; si no (CLI), lo devuelve tal cual."""
+    if not has_request_context():
+        return cursor
+    if 'consultas' not in g:
+        g.consultas = []
+    return CursorInstrumentado(cursor, g.consultas)
+
+
+def filas(consulta):
+    # rowcount de un SELECT sin buffer vale -1 hasta leerlo; se toma lo leído
+    return max(consulta['afectadas'], consulta['leidas'])
+
+
+def repetidas(consultas, maximo):
+    """Formas ejecutadas más de `maximo` veces, de más a menos repetida."""
+    return [(sql, veces) for sql, veces in Counter(c['sql'] for c in consultas).most_common() if veces > maximo]
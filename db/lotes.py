@@ -0,0 +1,29 @@
+from collections import OrderedDict
+
+# Máximo de ids por consulta IN (...); mantiene acotado el tamaño del SQL
+TAMANO_LOTE = 1000
+
+
+def agrupar(filas, clave):
+    """Agrupa una lista de filas (diccionarios) por el valor de `clave`."""
+    grupos = OrderedDict()
+    for fila in filas:
+        grupos.setdefault(fila[clave], []).append(fila)
+    return grupos
+
+
+def cargar_en_lote(cursor, query, ids, clave, tamano_lote=TAMANO_LOTE):
+    """Carga las filas hijas de varios padres con una consulta IN (...) por lote.
+
+    `query` debe contener el marcador `{ids}` donde va la lista de placeholders,
+    por ejemplo: "SELECT ... FROM Diagnóstico d WHERE d.ID_Historial IN ({ids})".
+    El cursor debe ser de tipo diccionario. Devuelve {id_padre: [filas]}; los ids
+    sin filas no aparecen en el resultado.
+    """
+    ids = list(OrderedDict.fromkeys(i for i in ids if i is not None))
+    filas = []
+    for inicio in range(0, len(ids), tamano_lote):
+        lote = ids[inicio:inicio + tamano_lote]
+        cursor.execute(query.format(ids=', '.join(['%s'] * len(lote))), lote)
+        filas.extend(cursor.fetchall())
+    return agrupar(filas, clave)
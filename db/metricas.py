@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+
+# Límites de los buckets de latencia, en segundos (los de Prometheus por defecto)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def etiquetas(**valores):
+    """Etiquetas en formato Prometheus: etiquetas(ruta='/x', metodo='GET') -> 'metodo="GET",ruta="/x"'."""
+    return ','.join(f'{clave}="{_escapar(valor)}"' for clave, valor in sorted(valores.items()))
+
+
+def _nuevo_fragmento():
+    return {'contadores': {}, 'gauges': {}, 'histogramas': {}}
+
+
+def _sumar(destino, origen):
+    for tipo in ('contadores', 'gauges'):
+        for clave, valor in origen[tipo].copy().items():
+            destino[tipo][clave] = destino[tipo].get(clave, 0) + valor
+    for clave, cubetas in origen['histogramas'].copy().items():
+        acumulado = destino['histogramas'].setdefault(clave, [0] * len(cubetas))
+        for i, valor in enumerate(list(cubetas)):
+            acumulado[i] += valor
+
+
+class Metricas:
+    """Contadores, gauges e histogramas sin locks al registrar.
+
+    Cada hilo escribe solo en su propio fragmento (un dict por tipo), así que
+    registrar un valor no compite con otros hilos; la lectura suma todos los
+    fragmentos. Con varios procesos (workers de Gunicorn) y `directorio`
+    configurado, cada proceso vuelca su total a `directorio/metricas-<pid>.json`
+    cada `intervalo` segundos y quien atiende /metrics suma los archivos. Los
+    gauges de procesos que ya no existen se descartan; sus contadores se
+    conservan.
+    """
+
+    def __init__(self, directorio=None, intervalo=5):
+        self._local = threading.local()
+        # [(hilo, fragmento)]; los de hilos terminados se acumulan en _base
+        self._fragmentos = []
+        self._base = _nuevo_fragmento()
+        # Solo se toma al crear el fragmento de un hilo nuevo y al leer
+        self._registro = threading.Lock()
+        self._tipos = {}
+        self._directorio = directorio
+        self._intervalo = intervalo
+        self._ultimo_volcado = 0
+
+    def definir(self, nombre, tipo, ayuda):
+        self._tipos[nombre] = (tipo, ayuda)
+
+    def _fragmento(self):
+        fragmento = getattr(self._local, 'fragmento', None)
+        if fragmento is None:
+            fragmento = _nuevo_fragmento()
+            with self._registro:
+                self._fragmentos.append((threading.current_thread(), fragmento))
+            self._local.fragmento = fragmento
+        return fragmento
+
+    def incrementar(self, nombre, etiquetas='', valor=1):
+        contadores = self._fragmento()['contadores']
+        clave = (nombre, etiquetas)
+        contadores[clave] = contadores.get(clave, 0) + valor
+
+    def sumar_gauge(self, nombre, etiquetas='', delta=1):
+        gauges = self._fragmento()['gauges']
+        clave = (nombre, etiquetas)
+        gauges[clave] = gauges.get(clave, 0) + delta
+
+    def observar(self, nombre, etiquetas, valor):
+        histogramas = self._fragmento()['histogramas']
+        clave = (nombre, etiquetas)
+        cubetas = histogramas.get(clave)
+        if cubetas is None:
+            # Un conteo por bucket, +Inf y la suma
+            cubetas = histogramas[clave] = [0] * (len(BUCKETS) + 2)
+        for i, limite in enumerate(BUCKETS):
+            if valor <= limite:
+                cubetas[i] += 1
+                break
+        else:
+            cubetas[len(BUCKETS)] += 1
+        cubetas[-1] += valor
+
+    def _totales(self):
+        with self._registro:
+            # Un hilo terminado ya no escribe: su fragmento se suma a la base y se
+            # libera (el servidor de desarrollo crea un hilo por request)
+            vivos = []
+            for hilo, fragmento in self._fragmentos:
+                if hilo.is_alive():
+                    vivos.append((hilo, fragmento))
+                else:
+                    _sumar(self._base, fragmento)
+            self._fragmentos = vivos
+            totales = _nuevo_fragmento()
+            _sumar(totales, self._base)
+        for _, fragmento in vivos:
+            _sumar(totales, fragmento)
+        return totales
+
+    def volcar(self, forzar=False):
+        """Escribe el total de este proceso en el directorio compartido, si hay uno."""
+        if not self._directorio:
+            return
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_volcado < self._intervalo:
+            return
+        self._ultimo_volcado = ahora
+        datos = {
+            tipo: [[nombre, etiquetas_, valor] for (nombre, etiquetas_), valor in valores.items()]
+            for tipo, valores in self._totales().items()
+        }
+        ruta = os.path.join(self._directorio, f'metricas-{os.getpid()}.json')
+        temporal = f'{ruta}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(datos, archivo)
+        os.replace(temporal, ruta)
+
+    def _otros_procesos(self):
+        if not self._directorio or not os.path.isdir(self._directorio):
+            return
+        propio = f'metricas-{os.getpid()}.json'
+        for nombre_archivo in os.listdir(self._directorio):
+            if not nombre_archivo.endswith('.json') or nombre_archivo == propio:
+                continue
+            try:
+                pid = int(nombre_archivo[len('metricas-'):-len('.json')])
+                with open(os.path.join(self._directorio, nombre_archivo), encoding='utf-8') as archivo:
+                    datos = json.load(archivo)
+            except (ValueError, OSError):
+                continue
+            yield pid, datos
+
+    @staticmethod
+    def _vivo(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def texto(self):
+        """Todas las métricas en el formato de texto de Prometheus."""
+        totales = self._totales()
+        for pid, datos in self._otros_procesos():
+            vivo = self._vivo(pid)
+            otro = {
+                tipo: {(nombre, etiquetas_): valor for nombre, etiquetas_, valor in datos.get(tipo, [])}
+                for tipo in ('contadores', 'gauges', 'histogramas')
+            }
+            if not vivo:
+                otro['gauges'] = {}
+            _sumar(totales, otro)
+
+        series = {}
+        for tipo in ('contadores', 'gauges'):
+            for (nombre, etiquetas_), valor in totales[tipo].items():
+                series.setdefault(nombre, []).append(f'{nombre}{{{etiquetas_}}} {valor}' if etiquetas_
+                                                     else f'{nombre} {valor}')
+        for (nombre, etiquetas_), cubetas in totales['histogramas'].items():
+            prefijo = f'{etiquetas_},' if etiquetas_ else ''
+            lineas = series.setdefault(nombre, [])
+            acumulado = 0
+            for limite, conteo in zip(list(BUCKETS) + ['+Inf'], cubetas):
+                acumulado += conteo
+                lineas.append(f'{nombre}_bucket{{{prefijo}le="{limite}"}} {acumulado}')
+            sufijo = f'{{{etiquetas_}}}' if etiquetas_ else ''
+            lineas.append(f'{nombre}_sum{sufijo} {cubetas[-1]}')
+            lineas.append(f'{nombre}_count{sufijo} {acumulado}')
+
+        salida = []
+        for nombre in sorted(series):
+            tipo, ayuda = self._tipos.get(nombre, ('untyped', ''))
+            salida.append(f'# HELP {nombre} {ayuda}')
+            salida.append(f'# TYPE {nombre} {tipo}')
+            salida.extend(sorted(series[nombre]) if tipo != 'histogram' else series[nombre])
+        return '\n'.join(salida) + '\n'
+
+
+metricas = Metricas(os.environ.get('METRICAS_DIR'))
+metricas.definir('http_requests_total', 'counter', 'Requests atendidos por ruta, método y estado.')
+metricas.definir('http_request_duration_seconds', 'histogram', 'Latencia de los requests por ruta y método.')
+metricas.definir('http_requests_in_flight', 'gauge', 'Requests en curso por ruta y método.')
+metricas.definir('db_connections_open', 'gauge', 'Conexiones MySQL abiertas.')
+metricas.definir('db_connections_total', 'counter', 'Conexiones MySQL abiertas desde el inicio.')
+metricas.definir('db_connection_errors_total', 'counter', 'Intentos de conexión MySQL fallidos.')
+metricas.definir('db_connect_duration_seconds', 'histogram', 'Tiempo para obtener una conexión MySQL.')
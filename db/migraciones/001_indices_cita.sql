@@ -0,0 +1,4 @@
+-- Índices compuestos para las agendas filtradas por rango de fechas
+-- (GET /citas/medico/<id> y GET /citas/paciente/<id>).
+CREATE INDEX idx_cita_medico_fecha ON Cita (ID_Médico, Fecha, Hora);
+CREATE INDEX idx_cita_paciente_fecha ON Cita (ID_Paciente, Fecha, Hora);
@@ -0,0 +1,6 @@
+-- Marca de última modificación por cita, usada como validador (ETag /
+-- Last-Modified) del feed iCalendar de GET /medicos/<id>/agenda.ics.
+ALTER TABLE Cita
+    ADD COLUMN Actualizado TIMESTAMP NOT NULL
+        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+CREATE INDEX idx_cita_medico_actualizado ON Cita (ID_Médico, Actualizado);
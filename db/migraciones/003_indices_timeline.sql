@@ -0,0 +1,4 @@
+-- Índice para la paginación por fecha del timeline del paciente
+-- (GET /pacientes/<id>/timeline). Tratamiento y Medicamento ya tienen
+-- índice por su clave foránea.
+CREATE INDEX idx_diagnostico_historial_fecha ON Diagnóstico (ID_Historial, Fecha, ID_Diagnóstico);
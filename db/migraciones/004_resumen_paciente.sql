@@ -0,0 +1,15 @@
+-- Modelo de lectura con los datos agregados por paciente. Lo mantienen de
+-- forma incremental los endpoints de escritura (ver resumenPaciente.py) y se
+-- puede reconstruir con: flask --app app reconstruir-resumen
+CREATE TABLE Resumen_Paciente (
+    ID_Paciente INT NOT NULL PRIMARY KEY,
+    Total_Citas INT NOT NULL DEFAULT 0,
+    Proxima_Cita DATETIME NULL,
+    Ultimo_Diagnostico DATE NULL,
+    Tratamientos_Activos INT NOT NULL DEFAULT 0,
+    Proximo_Fin_Tratamiento DATE NULL,
+    Actualizado TIMESTAMP NOT NULL
+        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    CONSTRAINT fk_resumen_paciente FOREIGN KEY (ID_Paciente)
+        REFERENCES Paciente (ID_Paciente) ON DELETE CASCADE
+);
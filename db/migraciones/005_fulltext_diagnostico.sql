@@ -0,0 +1,2 @@
+-- Búsqueda de texto sobre diagnósticos (GET /diagnosticos/buscar)
+CREATE FULLTEXT INDEX ft_diagnostico_descripcion ON Diagnóstico (Descripción);
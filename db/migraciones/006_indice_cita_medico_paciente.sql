@@ -0,0 +1,3 @@
+-- Índice cubriente para el panel de pacientes de un médico
+-- (GET /medicos/<id>/pacientes): agrupa por paciente sin leer la tabla Cita.
+CREATE INDEX idx_cita_medico_paciente ON Cita (ID_Médico, ID_Paciente, Fecha);
@@ -0,0 +1,8 @@
+-- Versión por tabla para los índices en memoria (directorio de médicos, roles).
+-- Los endpoints de escritura la incrementan; cada worker la consulta por clave
+-- primaria para saber si debe recargar su copia.
+CREATE TABLE Version_Tabla (
+    Tabla VARCHAR(64) NOT NULL PRIMARY KEY,
+    Version BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO Version_Tabla (Tabla, Version) VALUES ('Médico', 0);
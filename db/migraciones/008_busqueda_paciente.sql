@@ -0,0 +1,15 @@
+-- Columnas de búsqueda de pacientes (GET /pacientes/buscar), calculadas por
+-- MySQL para que ningún INSERT o UPDATE tenga que mantenerlas. Son INVISIBLE:
+-- SELECT * no las devuelve.
+--  * Nombre_Busqueda: el nombre con intercalación insensible a mayúsculas y
+--    acentos, así LIKE 'jose%' encuentra 'José' usando el índice.
+--  * Telefono_Normalizado: solo los dígitos del teléfono.
+ALTER TABLE Paciente
+    ADD COLUMN Nombre_Busqueda VARCHAR(100)
+        CHARACTER SET utf8mb4 COLLATE utf8mb4_0900_ai_ci
+        AS (Nombre) STORED INVISIBLE,
+    ADD COLUMN Telefono_Normalizado VARCHAR(20)
+        AS (REGEXP_REPLACE(Teléfono, '[^0-9]', '')) STORED INVISIBLE;
+CREATE INDEX idx_paciente_nombre_busqueda ON Paciente (Nombre_Busqueda);
+CREATE INDEX idx_paciente_telefono_normalizado ON Paciente (Telefono_Normalizado);
+CREATE INDEX idx_paciente_fecha_nacimiento ON Paciente (Fecha_Nacimiento);
@@ -0,0 +1,20 @@
+-- Marca de última modificación para las exportaciones incrementales
+-- (GET /exportar/<tabla>?updated_since=...). Cita ya la tiene desde la 002.
+-- Las nuevas columnas son INVISIBLE para no cambiar las respuestas que usan SELECT *.
+ALTER TABLE Paciente
+    ADD COLUMN Actualizado TIMESTAMP NOT NULL
+        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP INVISIBLE;
+ALTER TABLE Diagnóstico
+    ADD COLUMN Actualizado TIMESTAMP NOT NULL
+        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP INVISIBLE;
+ALTER TABLE Tratamiento
+    ADD COLUMN Actualizado TIMESTAMP NOT NULL
+        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP INVISIBLE;
+ALTER TABLE Medicamento
+    ADD COLUMN Actualizado TIMESTAMP NOT NULL
+        DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP INVISIBLE;
+CREATE INDEX idx_paciente_actualizado ON Paciente (Actualizado);
+CREATE INDEX idx_cita_actualizado ON Cita (Actualizado);
+CREATE INDEX idx_diagnostico_actualizado ON Diagnóstico (Actualizado);
+CREATE INDEX idx_tratamiento_actualizado ON Tratamiento (Actualizado);
+CREATE INDEX idx_medicamento_actualizado ON Medicamento (Actualizado);
@@ -0,0 +1,7 @@
+-- Clave de identidad del paciente: SHA-1 de nombre, fecha de nacimiento y
+-- teléfono normalizados (db/identidad.py). La calcula la aplicación porque
+-- MySQL no puede quitar acentos. No es UNIQUE porque la tabla ya puede tener
+-- duplicados; los existentes se completan y reportan con:
+--   flask --app app duplicados-pacientes
+ALTER TABLE Paciente ADD COLUMN Clave_Identidad CHAR(40) NULL INVISIBLE;
+CREATE INDEX idx_paciente_clave_identidad ON Paciente (Clave_Identidad);
@@ -0,0 +1,2 @@
+-- Versión de la tabla Rol para el catálogo de roles en memoria (roles.py)
+INSERT INTO Version_Tabla (Tabla, Version) VALUES ('Rol', 0);
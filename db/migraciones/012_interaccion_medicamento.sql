@@ -0,0 +1,12 @@
+-- Reglas de interacción entre medicamentos. Cada proceso las mantiene en
+-- memoria como pares de nombres normalizados (medicamentos.py) y las relee
+-- cuando cambia la versión de 'Interaccion_Medicamento'. Tras editar la
+-- tabla a mano: flask --app app recargar-interacciones
+CREATE TABLE Interaccion_Medicamento (
+    ID_Interaccion INT AUTO_INCREMENT PRIMARY KEY,
+    Medicamento_A VARCHAR(100) NOT NULL,
+    Medicamento_B VARCHAR(100) NOT NULL,
+    Severidad VARCHAR(20) NOT NULL DEFAULT 'moderada',
+    Descripción VARCHAR(255) NULL
+);
+INSERT INTO Version_Tabla (Tabla, Version) VALUES ('Interaccion_Medicamento', 0);
@@ -0,0 +1,2 @@
+-- Versión de la tabla Diagnóstico para el autocompletado en memoria (diagnosticos.py)
+INSERT INTO Version_Tabla (Tabla, Version) VALUES ('Diagnóstico', 0);
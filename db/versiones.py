@@ -0,0 +1,18 @@
+# Contadores de versión por tabla para invalidar cachés en memoria entre workers.
+# Quien modifica la tabla incrementa su versión en la misma transacción; cada
+# proceso compara la versión guardada con la de su caché cada pocos segundos.
+
+
+def incrementar_version(cursor, tabla):
+    cursor.execute("""
+    INSERT INTO Version_Tabla (Tabla, Version) VALUES (%s, 1)
+    ON DUPLICATE KEY UPDATE Version = Version + 1
+    """, (tabla,))
+
+
+def leer_version(cursor, tabla):
+    cursor.execute("SELECT Version FROM Version_Tabla WHERE Tabla = %s", (tabla,))
+    fila = cursor.fetchone()
+    if not fila:
+        return 0
+    return fila['Version'] if isinstance(fila, dict) else fila[0]
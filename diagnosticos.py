@@ -2,10 +2,114 @@ from flask import Flask, request, jsonify
 from flask_jwt_extended import jwt_required
 from flask_cors import cross_origin
 import mysql.connector
+from mysql.connector.constants import ClientFlag
+import threading
+import time
 from datetime import datetime
-from db import app, db_config
+from db import app
+from db.conexion import conectar
+from resumenPaciente import registrar_diagnostico
+from db.busqueda import IndiceInvertido, IndicePrefijos
+from db.consultas import Consulta, ENTERO, FECHA, DESDE, HASTA
+from db.versiones import incrementar_version, leer_version
+from roles import requiere_rol, ADMIN, MEDICO
+
+# Filtros y órdenes aceptados por GET /diagnosticos
+FILTROS_DIAGNOSTICO = {
+    'id_historial': ('d.ID_Historial', ENTERO),
+    'id_cita': ('d.ID_Cita', ENTERO),
+    'id_paciente': ('h.ID_Paciente', ENTERO),
+    'fecha': ('d.Fecha', FECHA),
+    'desde': ('d.Fecha', DESDE),
+    'hasta': ('d.Fecha', HASTA)
+}
+ORDENES_DIAGNOSTICO = {
+    # fecha_orden es d.Fecha sin formatear: el cursor debe compararse con el valor de la columna
+    'fecha': [('d.Fecha', 'fecha_orden'), ('d.ID_Diagnóstico', 'ID_Diagnóstico')],
+    'id': [('d.ID_Diagnóstico', 'ID_Diagnóstico')]
+}
+FILTROS_BUSQUEDA = {
+    'id_paciente': ('h.ID_Paciente', ENTERO),
+    'desde': ('d.Fecha', DESDE),
+    'hasta': ('d.Fecha', HASTA)
+}
+ORDENES_BUSQUEDA = {
+    'relevancia': [('relevancia', 'relevancia'), ('d.ID_Diagnóstico', 'ID_Diagnóstico')]
+}
+
+BUSQUEDA_LIMITE = 20
+BUSQUEDA_LIMITE_MAX = 100
+
+# Respaldo en memoria del índice FULLTEXT; se carga en la primera búsqueda
+indice_diagnosticos = IndiceInvertido()
+
+SUGERENCIAS_LIMITE = 10
+SUGERENCIAS_LIMITE_MAX = 50
+
+
+class SugerenciasDiagnostico:
+    """Autocompletado de descripciones de diagnóstico con su versión en Version_Tabla.
+
+    Se recarga cuando la versión de 'Diagnóstico' cambia por un alta de otro
+    proceso; la versión se consulta como máximo cada `intervalo` segundos. Las
+    altas de este proceso se suman al índice sin releer la tabla.
+    """
+
+    def __init__(self, intervalo=5):
+        self._lock = threading.Lock()
+        self._intervalo = intervalo
+        self._indice = IndicePrefijos()
+        self._version = None
+        self._ultimo_chequeo = 0
+
+    def requiere_consulta(self):
+        """True si hay que ir a la base de datos (sin cargar o intervalo vencido)."""
+        return self._version is None or time.monotonic() - self._ultimo_chequeo >= self._intervalo
+
+    def _vigente(self, cursor):
+        if self._version is None:
+            return False
+        if time.monotonic() - self._ultimo_chequeo < self._intervalo:
+            return True
+        self._ultimo_chequeo = time.monotonic()
+        return leer_version(cursor, 'Diagnóstico') == self._version
+
+    def asegurar_vigente(self, cursor):
+        with self._lock:
+            if self._vigente(cursor):
+                return
+            # Versión antes de leer la tabla: un alta concurrente fuerza otra recarga
+            version = leer_version(cursor, 'Diagnóstico')
+            cursor.execute("""
+            SELECT Descripción, COUNT(*)
+            FROM Diagnóstico
+            GROUP BY Descripción
+            """)
+            self._indice.cargar(cursor.fetchall())
+            self._version = version
+            self._ultimo_chequeo = time.monotonic()
+            app.logger.info(f"Diagnosis suggestion index loaded (version {version})")
+
+    def agregar(self, descripcion, version):
+        """Suma un alta de este proceso; `version` es la que dejó su transacción."""
+        with self._lock:
+            if self._version is None:
+                return
+            if version == self._version + 1:
+                self._indice.agregar(descripcion)
+                self._version = version
+            else:
+                # Hubo altas de otros procesos entre medio: se relee la tabla
+                self._version = None
+
+    def sugerir(self, prefijo, limite):
+        return self._indice.sugerir(prefijo, limite)
+
+
+indice_sugerencias = SugerenciasDiagnostico()
 
 @app.route('/diagnosticos/crear', methods=['POST'])
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def create_diagnostico_with_patient():
     cursor = None
@@ -42,45 +146,58 @@ def create_diagnostico_with_patient():
                 'error': 'Invalid ID format - must be integers'
             }), 400
         
-        connection = mysql.connector.connect(**db_config)
+        # FOUND_ROWS: el UPDATE del resumen cuenta la fila aunque la fecha no cambie
+        connection = conectar(client_flags=[ClientFlag.FOUND_ROWS])
         cursor = connection.cursor(dictionary=True)
         
-        # Get patient's medical history
-        history_query = """
-        SELECT ID_Historial 
-        FROM Historial_Médico 
-        WHERE ID_Paciente = %s
-        ORDER BY Fecha_Creación DESC
-        LIMIT 1
-        """
-        cursor.execute(history_query, (id_paciente,))
-        history = cursor.fetchone()
+        expand = request.args.get('expand')
+        
+        # Historial más reciente del paciente y cita en una sola consulta; siempre devuelve
+        # una fila para distinguir "sin historial" de "cita inexistente"
+        columnas = [
+            """(SELECT h.ID_Historial FROM Historial_Médico h
+                WHERE h.ID_Paciente = %s
+                ORDER BY h.Fecha_Creación DESC
+                LIMIT 1) AS ID_Historial""",
+            "c.ID_Cita"
+        ]
+        joins = "LEFT JOIN Cita c ON c.ID_Cita = %s AND c.ID_Paciente = %s"
+        params = [id_paciente, id_cita, id_paciente]
+        if expand:
+            # Datos de paciente, cita y médico solo cuando el cliente los pide
+            columnas += [
+                "p.Nombre as nombre_paciente",
+                "DATE_FORMAT(c.Fecha, '%Y-%m-%d') as fecha_cita",
+                "TIME_FORMAT(c.Hora, '%H:%i:%s') as hora_cita",
+                "m.Nombre as nombre_medico"
+            ]
+            joins += """
+            LEFT JOIN Paciente p ON p.ID_Paciente = c.ID_Paciente
+            LEFT JOIN Médico m ON m.ID_Médico = c.ID_Médico"""
+        
+        cursor.execute(f"""
+        SELECT {', '.join(columnas)}
+        FROM (SELECT 1) AS x
+        {joins}
+        """, params)
+        contexto = cursor.fetchone()
         
-        if not history:
+        if not contexto['ID_Historial']:
             app.logger.warning(f"No medical history found for patient {id_paciente}")
             return jsonify({
                 'success': False,
                 'error': f'No medical history found for patient ID {id_paciente}'
             }), 404
         
-        id_historial = history['ID_Historial']
-        
-        # Verify appointment exists and belongs to the patient
-        appointment_query = """
-        SELECT ID_Cita, Fecha, Hora, Estado 
-        FROM Cita 
-        WHERE ID_Cita = %s AND ID_Paciente = %s
-        """
-        cursor.execute(appointment_query, (id_cita, id_paciente))
-        appointment = cursor.fetchone()
-        
-        if not appointment:
+        if not contexto['ID_Cita']:
             app.logger.warning(f"Appointment {id_cita} not found for patient {id_paciente}")
             return jsonify({
                 'success': False,
                 'error': f'Appointment not found or does not belong to patient'
             }), 404
         
+        id_historial = contexto['ID_Historial']
+        
         # Create the diagnosis
         fecha_diagnostico = data.get('fecha', datetime.now().date())
         
@@ -98,67 +215,35 @@ def create_diagnostico_with_patient():
         
         cursor.execute(diagnosis_query, values)
         diagnosis_id = cursor.lastrowid
+        registrar_diagnostico(cursor, id_paciente, fecha_diagnostico)
+        incrementar_version(cursor, 'Diagnóstico')
+        version_diagnosticos = leer_version(cursor, 'Diagnóstico')
         connection.commit()
         
-        # Get complete diagnosis information for response
-        try:
-            complete_query = """
-            SELECT 
-                d.ID_Diagnóstico,
-                d.Descripción,
-                DATE_FORMAT(d.Fecha, '%Y-%m-%d') as Fecha,
-                d.ID_Historial,
-                d.ID_Cita
-            FROM Diagnóstico d
-            WHERE d.ID_Diagnóstico = %s
-            """
-            
-            cursor.execute(complete_query, (diagnosis_id,))
-            complete_diagnosis = cursor.fetchone()
-            
-            # If the basic query works, try to get additional info
-            if complete_diagnosis:
-                try:
-                    extended_query = """
-                    SELECT 
-                        d.ID_Diagnóstico,
-                        d.Descripción,
-                        DATE_FORMAT(d.Fecha, '%Y-%m-%d') as Fecha,
-                        d.ID_Historial,
-                        d.ID_Cita,
-                        p.ID_Paciente,
-                        p.Nombre as nombre_paciente,
-                        DATE_FORMAT(c.Fecha, '%Y-%m-%d') as fecha_cita,
-                        TIME_FORMAT(c.Hora, '%H:%i:%s') as hora_cita,
-                        m.Nombre as nombre_medico
-                    FROM Diagnóstico d
-                    JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
-                    JOIN Paciente p ON h.ID_Paciente = p.ID_Paciente
-                    JOIN Cita c ON d.ID_Cita = c.ID_Cita
-                    JOIN Médico m ON c.ID_Médico = m.ID_Médico
-                    WHERE d.ID_Diagnóstico = %s
-                    """
-                    
-                    cursor.execute(extended_query, (diagnosis_id,))
-                    extended_result = cursor.fetchone()
-                    
-                    if extended_result:
-                        complete_diagnosis = extended_result
-                    
-                except mysql.connector.Error as join_error:
-                    app.logger.warning(f"Could not fetch extended diagnosis info: {join_error}")
-                    # Continue with basic diagnosis info
-                    
-        except mysql.connector.Error as query_error:
-            app.logger.error(f"Error fetching diagnosis info: {query_error}")
-            # Return basic success response without detailed diagnosis info
-            complete_diagnosis = {
-                'ID_Diagnóstico': diagnosis_id,
-                'Descripción': data['descripcion'],
-                'Fecha': str(fecha_diagnostico),
-                'ID_Historial': id_historial,
-                'ID_Cita': id_cita
-            }
+        if indice_diagnosticos.cargado:
+            indice_diagnosticos.agregar(
+                diagnosis_id, data['descripcion'],
+                id_paciente=id_paciente, fecha=str(fecha_diagnostico)[:10]
+            )
+        
+        indice_sugerencias.agregar(data['descripcion'], version_diagnosticos)
+        
+        # La respuesta se arma con los valores ya conocidos, sin releer el diagnóstico
+        complete_diagnosis = {
+            'ID_Diagnóstico': diagnosis_id,
+            'Descripción': data['descripcion'],
+            'Fecha': str(fecha_diagnostico)[:10],
+            'ID_Historial': id_historial,
+            'ID_Cita': id_cita
+        }
+        if expand:
+            complete_diagnosis.update({
+                'ID_Paciente': id_paciente,
+                'nombre_paciente': contexto['nombre_paciente'],
+                'fecha_cita': contexto['fecha_cita'],
+                'hora_cita': contexto['hora_cita'],
+                'nombre_medico': contexto['nombre_medico']
+            })
         
         app.logger.info(f"Diagnosis created successfully for patient {id_paciente}")
         
@@ -196,19 +281,12 @@ def get_diagnosticos():
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor(dictionary=True)
-        
-
-        id_historial = request.args.get('id_historial')
-        id_cita = request.args.get('id_cita')
-        fecha = request.args.get('fecha')
-        
-        query = """
+        consulta = Consulta("""
         SELECT 
             d.ID_Diagnóstico,
             d.Descripción,
             DATE_FORMAT(d.Fecha, '%Y-%m-%d') as Fecha,
+            d.Fecha as fecha_orden,
             d.ID_Historial,
             d.ID_Cita,
             h.ID_Paciente,
@@ -216,30 +294,157 @@ def get_diagnosticos():
         FROM Diagnóstico d
         JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
         JOIN Paciente p ON h.ID_Paciente = p.ID_Paciente
-        WHERE 1=1
-        """
+        """)
+        try:
+            consulta.filtrar(request.args, FILTROS_DIAGNOSTICO)
+            consulta.ordenar(request.args.get('orden'), ORDENES_DIAGNOSTICO, '-fecha')
+            consulta.paginar(request.args.get('limite'), request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
         
-        params = []
+        cursor.execute(*consulta.sql())
+        diagnosticos, siguiente_cursor = consulta.paginar_resultado(cursor.fetchall())
+        for diagnostico in diagnosticos:
+            diagnostico.pop('fecha_orden')
         
-        if id_historial:
-            query += " AND d.ID_Historial = %s"
-            params.append(id_historial)
+        return jsonify({
+            'count': len(diagnosticos),
+            'diagnosticos': diagnosticos,
+            'siguiente_cursor': siguiente_cursor
+        })
+        
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error: {str(error)}")
+        return jsonify({'error': 'Error de base de datos'}), 500
+    except Exception as e:
+        app.logger.error(f"Unexpected error: {str(e)}")
+        return jsonify({'error': 'Error inesperado'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+def _buscar_en_memoria(cursor, q, id_paciente, desde, hasta, limite, offset):
+    """Búsqueda con el índice invertido en proceso; devuelve filas con su relevancia."""
+    if not indice_diagnosticos.cargado:
+        cursor.execute("""
+        SELECT d.ID_Diagnóstico, d.Descripción, DATE_FORMAT(d.Fecha, '%Y-%m-%d') as Fecha, h.ID_Paciente
+        FROM Diagnóstico d
+        JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+        """)
+        indice_diagnosticos.cargar(
+            (fila['ID_Diagnóstico'], fila['Descripción'],
+             {'id_paciente': fila['ID_Paciente'], 'fecha': fila['Fecha']})
+            for fila in cursor.fetchall()
+        )
+    
+    def filtro(meta):
+        if id_paciente and meta['id_paciente'] != id_paciente:
+            return False
+        if desde and (meta['fecha'] or '') < desde:
+            return False
+        if hasta and (meta['fecha'] or '') > hasta:
+            return False
+        return True
+    
+    pagina = indice_diagnosticos.buscar(q, filtro)[offset:offset + limite + 1]
+    if not pagina:
+        return []
+    
+    relevancia = dict(pagina)
+    cursor.execute(f"""
+    SELECT 
+        d.ID_Diagnóstico,
+        d.Descripción,
+        DATE_FORMAT(d.Fecha, '%Y-%m-%d') as Fecha,
+        d.ID_Historial,
+        d.ID_Cita,
+        h.ID_Paciente,
+        p.Nombre as nombre_paciente
+    FROM Diagnóstico d
+    JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+    JOIN Paciente p ON h.ID_Paciente = p.ID_Paciente
+    WHERE d.ID_Diagnóstico IN ({', '.join(['%s'] * len(relevancia))})
+    """, list(relevancia))
+    filas = cursor.fetchall()
+    for fila in filas:
+        fila['relevancia'] = round(relevancia[fila['ID_Diagnóstico']], 6)
+    filas.sort(key=lambda fila: (-fila['relevancia'], -fila['ID_Diagnóstico']))
+    return filas
+
+
+@app.route('/diagnosticos/buscar', methods=['GET'])
+@jwt_required()
+@cross_origin()
+def buscar_diagnosticos():
+    cursor = None
+    connection = None
+    try:
+        q = (request.args.get('q') or '').strip()
+        if not q:
+            return jsonify({'error': 'El parámetro q es requerido'}), 400
+        
+        try:
+            id_paciente = int(request.args['id_paciente']) if request.args.get('id_paciente') else None
+            desde = request.args.get('desde')
+            hasta = request.args.get('hasta')
+            for valor in (desde, hasta):
+                if valor:
+                    datetime.strptime(valor, '%Y-%m-%d')
+            limite = min(int(request.args.get('limite', BUSQUEDA_LIMITE)), BUSQUEDA_LIMITE_MAX)
+            pagina = int(request.args.get('pagina', 1))
+            if limite < 1 or pagina < 1:
+                raise ValueError('limite and pagina must be positive')
+        except ValueError as e:
+            return jsonify({'error': f'Parámetros inválidos: {str(e)}'}), 400
+        offset = (pagina - 1) * limite
+        
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+        
+        if app.config['BUSQUEDA_DIAGNOSTICOS'] == 'memoria':
+            diagnosticos = _buscar_en_memoria(cursor, q, id_paciente, desde, hasta, limite, offset)
+        else:
+            consulta = Consulta("""
+            SELECT 
+                d.ID_Diagnóstico,
+                d.Descripción,
+                DATE_FORMAT(d.Fecha, '%Y-%m-%d') as Fecha,
+                d.ID_Historial,
+                d.ID_Cita,
+                h.ID_Paciente,
+                p.Nombre as nombre_paciente,
+                MATCH(d.Descripción) AGAINST (%s IN NATURAL LANGUAGE MODE) as relevancia
+            FROM Diagnóstico d
+            JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+            JOIN Paciente p ON h.ID_Paciente = p.ID_Paciente
+            """, q)
+            consulta.donde("MATCH(d.Descripción) AGAINST (%s IN NATURAL LANGUAGE MODE)", q)
+            consulta.filtrar(request.args, FILTROS_BUSQUEDA)
+            consulta.ordenar('-relevancia', ORDENES_BUSQUEDA, '-relevancia')
             
-        if id_cita:
-            query += " AND d.ID_Cita = %s"
-            params.append(id_cita)
+            query, params = consulta.sql()
+            query += "\nLIMIT %s OFFSET %s"
+            params += [limite + 1, offset]
             
-        if fecha:
-            query += " AND DATE(d.Fecha) = %s"
-            params.append(fecha)
+            cursor.execute(query, params)
+            diagnosticos = cursor.fetchall()
+            for diagnostico in diagnosticos:
+                diagnostico['relevancia'] = round(float(diagnostico['relevancia']), 6)
         
-        query += " ORDER BY d.Fecha DESC"
-        
-        cursor.execute(query, params)
-        diagnosticos = cursor.fetchall()
+        hay_mas = len(diagnosticos) > limite
+        diagnosticos = diagnosticos[:limite]
         
         return jsonify({
             'count': len(diagnosticos),
+            'pagina': pagina,
+            'limite': limite,
+            'hay_mas': hay_mas,
             'diagnosticos': diagnosticos
         })
         
@@ -253,4 +458,48 @@ def get_diagnosticos():
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
\ No newline at end of file
+            connection.close()
+
+
+
+@app.route('/diagnosticos/sugerencias', methods=['GET'])
+@jwt_required()
+@cross_origin()
+def sugerir_diagnosticos():
+    cursor = None
+    connection = None
+    try:
+        prefijo = (request.args.get('prefijo') or '').strip()
+        if not prefijo:
+            return jsonify({'error': 'El parámetro prefijo es requerido'}), 400
+        try:
+            limite = min(int(request.args.get('limite', SUGERENCIAS_LIMITE)), SUGERENCIAS_LIMITE_MAX)
+        except ValueError:
+            return jsonify({'error': 'limite debe ser un entero'}), 400
+        if limite < 1:
+            return jsonify({'error': 'limite debe ser positivo'}), 400
+        
+        # La base solo se consulta para cargar el índice o comparar su versión
+        if indice_sugerencias.requiere_consulta():
+            connection = conectar()
+            cursor = connection.cursor()
+            indice_sugerencias.asegurar_vigente(cursor)
+        
+        sugerencias = [
+            {'descripcion': texto, 'frecuencia': frecuencia}
+            for texto, frecuencia in indice_sugerencias.sugerir(prefijo, limite)
+        ]
+        
+        return jsonify({'sugerencias': sugerencias})
+        
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error: {str(error)}")
+        return jsonify({'error': 'Error de base de datos'}), 500
+    except Exception as e:
+        app.logger.error(f"Unexpected error: {str(e)}")
+        return jsonify({'error': 'Error inesperado'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
@@ -0,0 +1,168 @@
+from flask import request, jsonify
+from flask_cors import cross_origin
+import mysql.connector
+from datetime import datetime, date, timedelta
+from db import app, cache
+from db.conexion import conectar
+from db.versiones import incrementar_version, leer_version
+from roles import requiere_rol, ADMIN, MEDICO
+
+GRANULARIDADES = ('dia', 'semana', 'mes')
+
+
+def _inicio_mes(fecha):
+    return fecha.replace(day=1)
+
+
+def _mes_siguiente(fecha):
+    return (fecha.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def _clave_mes(medico_id, mes, version):
+    return f"estadisticas:{medico_id}:{version}:{mes.strftime('%Y-%m')}"
+
+
+def _tabla_version(medico_id):
+    # Una fila de Version_Tabla por médico: solo cambia al tocar un mes ya cerrado
+    return f"Estadisticas:{medico_id}"
+
+
+def invalidar_estadisticas(cursor, medico_id, fecha):
+    """Marca como vencidos los meses cacheados del médico si la cita cae en un mes cerrado.
+
+    Se llama dentro de la transacción que crea, modifica o borra la cita, así la
+    nueva versión llega a todos los workers junto con el cambio. El mes en curso
+    nunca se guarda en caché y no necesita invalidarse.
+    """
+    if not medico_id or not fecha:
+        return
+    if isinstance(fecha, str):
+        fecha = datetime.strptime(fecha[:10], '%Y-%m-%d').date()
+    if isinstance(fecha, datetime):
+        fecha = fecha.date()
+    if _inicio_mes(fecha) < _inicio_mes(date.today()):
+        incrementar_version(cursor, _tabla_version(medico_id))
+
+
+def _periodo(fecha, granularidad):
+    if granularidad == 'mes':
+        return fecha.strftime('%Y-%m')
+    if granularidad == 'semana':
+        return (fecha - timedelta(days=fecha.weekday())).strftime('%Y-%m-%d')
+    return fecha.strftime('%Y-%m-%d')
+
+
+def _filas_por_mes(cursor, medico_id, desde, hasta):
+    """Conteos (fecha, hora, estado) entre desde y hasta (exclusivo), agrupados por mes.
+
+    Los meses ya cerrados se guardan en caché bajo la versión del médico en
+    Version_Tabla, que sube al modificar una cita de un mes cerrado en cualquier
+    worker; solo se consulta desde el primer mes sin caché, normalmente el mes
+    en curso. Es una única consulta GROUP BY sobre el índice (ID_Médico, Fecha, Hora).
+    """
+    version = leer_version(cursor, _tabla_version(medico_id))
+    mes_actual = _inicio_mes(date.today())
+    meses = {}
+    mes = _inicio_mes(desde)
+    consultar_desde = None
+    while mes < hasta:
+        filas = cache.get(_clave_mes(medico_id, mes, version)) if mes < mes_actual else None
+        if filas is None:
+            consultar_desde = mes
+            break
+        meses[mes] = filas
+        mes = _mes_siguiente(mes)
+
+    if consultar_desde:
+        cursor.execute("""
+        SELECT c.Fecha, HOUR(c.Hora) AS hora, c.Estado, COUNT(*) AS total
+        FROM Cita c
+        WHERE c.ID_Médico = %s AND c.Fecha >= %s AND c.Fecha < %s
+        GROUP BY c.Fecha, HOUR(c.Hora), c.Estado
+        """, (medico_id, consultar_desde, _mes_siguiente(hasta - timedelta(days=1))))
+        mes = consultar_desde
+        while mes < hasta:
+            meses[mes] = []
+            mes = _mes_siguiente(mes)
+        for fila in cursor.fetchall():
+            meses[_inicio_mes(fila['Fecha'])].append(
+                (fila['Fecha'], fila['hora'], fila['Estado'], fila['total'])
+            )
+        for mes, filas in meses.items():
+            if consultar_desde <= mes < mes_actual:
+                cache.set(_clave_mes(medico_id, mes, version), filas, timeout=0)
+
+    return [fila for mes in sorted(meses) for fila in meses[mes] if desde <= fila[0] < hasta]
+
+
+@app.route('/medicos/<int:medico_id>/estadisticas', methods=['GET'])
+@requiere_rol(ADMIN, MEDICO)
+@cross_origin()
+def get_estadisticas_medico(medico_id):
+    cursor = None
+    connection = None
+    try:
+        # Por defecto, el mes en curso
+        try:
+            hoy = date.today()
+            desde_param = request.args.get('desde')
+            hasta_param = request.args.get('hasta')
+            desde = datetime.strptime(desde_param, '%Y-%m-%d').date() if desde_param else _inicio_mes(hoy)
+            hasta_inclusive = (datetime.strptime(hasta_param, '%Y-%m-%d').date() if hasta_param
+                               else _mes_siguiente(hoy) - timedelta(days=1))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid date format: {str(e)}'}), 400
+        granularidad = request.args.get('granularidad', 'dia')
+        if granularidad not in GRANULARIDADES:
+            return jsonify({'error': f'granularidad must be one of: {", ".join(GRANULARIDADES)}'}), 400
+        if hasta_inclusive < desde:
+            return jsonify({'error': 'hasta must not be before desde'}), 400
+        hasta = hasta_inclusive + timedelta(days=1)
+
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+
+        cursor.execute("SELECT ID_Médico, Nombre FROM Médico WHERE ID_Médico = %s", (medico_id,))
+        doctor = cursor.fetchone()
+        if not doctor:
+            return jsonify({'error': 'Doctor not found'}), 404
+
+        filas = _filas_por_mes(cursor, medico_id, desde, hasta)
+
+        series = {}
+        por_estado = {}
+        # Ocupación: citas por día de la semana (0 = lunes) y hora
+        heatmap = [[0] * 24 for _ in range(7)]
+        total = 0
+        for fecha, hora, estado, cantidad in filas:
+            periodo = series.setdefault(_periodo(fecha, granularidad), {'total': 0, 'por_estado': {}})
+            periodo['total'] += cantidad
+            periodo['por_estado'][estado] = periodo['por_estado'].get(estado, 0) + cantidad
+            por_estado[estado] = por_estado.get(estado, 0) + cantidad
+            if hora is not None:
+                heatmap[fecha.weekday()][hora] += cantidad
+            total += cantidad
+
+        return jsonify({
+            'success': True,
+            'medico': doctor,
+            'desde': desde.strftime('%Y-%m-%d'),
+            'hasta': hasta_inclusive.strftime('%Y-%m-%d'),
+            'granularidad': granularidad,
+            'total': total,
+            'por_estado': por_estado,
+            'series': [{'periodo': periodo, **valores} for periodo, valores in sorted(series.items())],
+            'heatmap': heatmap
+        })
+
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error in get_estadisticas_medico: {error}")
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        app.logger.error(f"Unexpected error in get_estadisticas_medico: {e}")
+        return jsonify({'error': 'Unexpected error'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
@@ -0,0 +1,203 @@
+from flask import Response, request, jsonify
+from flask_cors import cross_origin
+import click
+import csv
+import io
+import json
+import zlib
+import mysql.connector
+from datetime import date, datetime, timedelta
+from db import app
+from db.conexion import conectar
+from roles import requiere_rol, ADMIN
+
+FORMATOS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+# Recurso exportado -> (tabla, columnas). La primera columna es la clave primaria.
+EXPORTACIONES = {
+    'pacientes': ('Paciente', ['ID_Paciente', 'Nombre', 'Fecha_Nacimiento', 'Género', 'Teléfono', 'Actualizado']),
+    'citas': ('Cita', ['ID_Cita', 'Fecha', 'Hora', 'ID_Paciente', 'ID_Médico', 'Estado', 'Actualizado']),
+    'diagnosticos': ('Diagnóstico', ['ID_Diagnóstico', 'Descripción', 'Fecha', 'ID_Historial', 'ID_Cita', 'Actualizado']),
+    'tratamientos': ('Tratamiento', ['ID_Tratamiento', 'Descripción', 'Fecha_Inicio', 'Fecha_Fin', 'ID_Diagnóstico', 'Actualizado']),
+    'medicamentos': ('Medicamento', ['ID_Medicamento', 'Nombre', 'Dosis', 'ID_Tratamiento', 'Actualizado'])
+}
+
+# Bytes acumulados antes de entregar un fragmento al cliente
+TAMANO_FRAGMENTO = 64 * 1024
+
+# Margen restado a la marca devuelta: una fila con Actualizado anterior a NOW() cuya
+# transacción confirma después de la lectura no se pierde en la siguiente extracción.
+# Debe cubrir la transacción más larga esperada; a cambio se repiten algunas filas.
+MARGEN_MARCA = timedelta(minutes=5)
+
+
+def _valor(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    if isinstance(valor, timedelta):
+        return str(valor)
+    return valor
+
+
+def consulta_exportacion(recurso, desde=None):
+    """Devuelve (sql, params) que recorre la tabla por orden de modificación."""
+    tabla, columnas = EXPORTACIONES[recurso]
+    sql = f"SELECT {', '.join(columnas)} FROM {tabla}"
+    params = []
+    if desde:
+        # >= y no >: una fila modificada en el mismo segundo que la marca no se pierde
+        sql += " WHERE Actualizado >= %s"
+        params.append(desde)
+    sql += f" ORDER BY Actualizado, {columnas[0]}"
+    return sql, params
+
+
+def generar_exportacion(cursor, columnas, formato):
+    """Convierte las filas del cursor en fragmentos de texto NDJSON o CSV."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator='\n')
+    if formato == 'csv':
+        escritor.writerow(columnas)
+    for fila in cursor:
+        if formato == 'csv':
+            escritor.writerow([_valor(v) for v in fila])
+        else:
+            buffer.write(json.dumps(dict(zip(columnas, map(_valor, fila))), ensure_ascii=False))
+            buffer.write('\n')
+        if buffer.tell() >= TAMANO_FRAGMENTO:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def comprimir(fragmentos):
+    """Comprime en gzip a medida que llegan los fragmentos."""
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for fragmento in fragmentos:
+        datos = compresor.compress(fragmento.encode('utf-8'))
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+
+def _leer_marca(valor):
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor)
+    except ValueError:
+        raise ValueError(f"Valor inválido para 'updated_since': {valor}")
+
+
+def _stream_exportacion(connection, cursor, fragmentos, recurso):
+    try:
+        yield from fragmentos
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error streaming export of {recurso}: {error}")
+    finally:
+        # Si el cliente corta la descarga pueden quedar filas sin leer
+        try:
+            cursor.close()
+            connection.close()
+        except Exception as cleanup_error:
+            app.logger.error(f"Error closing export stream: {str(cleanup_error)}")
+
+
+@app.route('/exportar/<recurso>', methods=['GET'])
+@requiere_rol(ADMIN)
+@cross_origin()
+def exportar(recurso):
+    cursor = None
+    connection = None
+    try:
+        if recurso not in EXPORTACIONES:
+            return jsonify({'error': f"Unknown export. Options: {', '.join(EXPORTACIONES)}"}), 404
+        formato = request.args.get('formato', 'ndjson')
+        if formato not in FORMATOS:
+            return jsonify({'error': f"formato must be one of: {', '.join(FORMATOS)}"}), 400
+        try:
+            desde = _leer_marca(request.args.get('updated_since'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        connection = conectar()
+        cursor = connection.cursor(buffered=True)
+        # Marca para la próxima extracción incremental, tomada antes de leer y con margen
+        cursor.execute("SELECT NOW()")
+        marca = cursor.fetchone()[0] - MARGEN_MARCA
+        cursor.close()
+
+        # Cursor sin buffer: las filas se leen del servidor a medida que se envían
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(*consulta_exportacion(recurso, desde))
+
+        fragmentos = generar_exportacion(cursor, EXPORTACIONES[recurso][1], formato)
+        gzip = 'gzip' in request.accept_encodings
+        if gzip:
+            fragmentos = comprimir(fragmentos)
+        stream = _stream_exportacion(connection, cursor, fragmentos, recurso)
+        # El generador es ahora responsable de cerrar el cursor y la conexión
+        cursor = None
+        connection = None
+
+        response = Response(stream, mimetype=FORMATOS[formato])
+        if gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Content-Disposition'] = f'attachment; filename="{recurso}.{formato}"'
+        response.headers['X-Watermark'] = marca.isoformat()
+        return response
+
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error in exportar: {error}")
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        app.logger.error(f"Unexpected error in exportar: {e}")
+        return jsonify({'error': 'Unexpected error'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@app.cli.command('exportar')
+@click.argument('recurso', type=click.Choice(list(EXPORTACIONES)))
+@click.option('--formato', type=click.Choice(list(FORMATOS)), default='ndjson', show_default=True)
+@click.option('--updated-since', 'updated_since', default=None,
+              help='Solo filas modificadas desde esta fecha (ISO 8601).')
+@click.option('--salida', type=click.Path(dir_okay=False), default=None,
+              help='Archivo de salida; con extensión .gz se comprime. Por defecto, stdout.')
+def exportar_cli(recurso, formato, updated_since, salida):
+    """Exporta una tabla completa o incremental como NDJSON o CSV."""
+    try:
+        desde = _leer_marca(updated_since)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    connection = conectar()
+    cursor = connection.cursor(buffered=True)
+    try:
+        cursor.execute("SELECT NOW()")
+        marca = cursor.fetchone()[0] - MARGEN_MARCA
+        cursor.close()
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(*consulta_exportacion(recurso, desde))
+        fragmentos = generar_exportacion(cursor, EXPORTACIONES[recurso][1], formato)
+        if salida and salida.endswith('.gz'):
+            with open(salida, 'wb') as archivo:
+                for datos in comprimir(fragmentos):
+                    archivo.write(datos)
+        elif salida:
+            with open(salida, 'w', encoding='utf-8', newline='') as archivo:
+                for fragmento in fragmentos:
+                    archivo.write(fragmento)
+        else:
+            for fragmento in fragmentos:
+                click.echo(fragmento, nl=False)
+        # La marca va a stderr para no mezclarse con los datos en stdout
+        click.echo(f"Watermark: {marca.isoformat()}", err=True)
+    finally:
+        cursor.close()
+        connection.close()
@@ -3,10 +3,13 @@ from flask_jwt_extended import jwt_required
 from flask_cors import cross_origin
 import mysql.connector
 from datetime import datetime
-from db import app, db_config
+from db import app
+from db.conexion import conectar
+from db.lotes import cargar_en_lote
+from roles import requiere_rol, ADMIN, MEDICO
 
 @app.route('/historial', methods=['POST'])
-@jwt_required()
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def create_historial():
     cursor = None
@@ -22,7 +25,7 @@ def create_historial():
         if missing_fields:
             return jsonify({'error': f'Missing fields: {", ".join(missing_fields)}'}), 400
         
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
         
         # Verificar que el paciente exista
@@ -52,12 +55,13 @@ def create_historial():
             connection.close()
 
 @app.route('/historial/paciente/<int:paciente_id>', methods=['GET'])
+@jwt_required()
 @cross_origin()
 def get_historial_paciente(paciente_id):
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
    
@@ -78,24 +82,24 @@ def get_historial_paciente(paciente_id):
         if not historiales:
             return jsonify({'message': 'No se encontraron registros de historial para este paciente'}), 404
         
-       
+        # Todos los diagnósticos del paciente en una sola consulta, agrupados por historial
+        diagnostico_query = """
+        SELECT 
+            d.ID_Diagnóstico,
+            d.Descripción,
+            DATE_FORMAT(d.Fecha, '%Y-%m-%d') as Fecha,
+            d.ID_Historial,
+            d.ID_Cita
+        FROM Diagnóstico d
+        WHERE d.ID_Historial IN ({ids})
+        ORDER BY d.Fecha DESC
+        """
+        diagnosticos = cargar_en_lote(
+            cursor, diagnostico_query, [h['ID_Historial'] for h in historiales], 'ID_Historial'
+        )
+        
         for historial in historiales:
-            diagnostico_query = """
-            SELECT 
-                d.ID_Diagnóstico,
-                d.Descripción,
-                DATE_FORMAT(d.Fecha, '%Y-%m-%d') as Fecha,
-                d.ID_Historial,
-                d.ID_Cita
-            FROM Diagnóstico d
-            WHERE d.ID_Historial = %s
-            ORDER BY d.Fecha DESC
-            """
-            cursor.execute(diagnostico_query, (historial['ID_Historial'],))
-            diagnosticos = cursor.fetchall()
-            
-           
-            historial['diagnosticos'] = diagnosticos if diagnosticos else []
+            historial['diagnosticos'] = diagnosticos.get(historial['ID_Historial'], [])
         
         return jsonify(historiales)
         
@@ -1,13 +1,190 @@
 from flask import Flask, request, jsonify
 from flask_jwt_extended import jwt_required
 from flask_cors import cross_origin
+import click
 import mysql.connector
-from datetime import datetime
-from db import app, db_config
+import threading
+import time
+from datetime import date, datetime
+from db import app, cache
+from db.conexion import conectar
+from db.busqueda import normalizar
+from db.versiones import incrementar_version, leer_version
+from roles import requiere_rol, ADMIN, MEDICO
+
+# Segundos que dura en caché la lista de medicamentos activos de un paciente.
+# La clave lleva la versión del paciente en Version_Tabla (sube con cada receta,
+# en cualquier worker) y la fecha, porque los tratamientos terminan con los días.
+MEDICAMENTOS_ACTIVOS_TTL = 300
+
+MEDICAMENTOS_ACTIVOS_SQL = """
+SELECT
+    m.ID_Medicamento,
+    m.Nombre,
+    m.Dosis,
+    t.ID_Tratamiento,
+    t.Descripción as descripcion_tratamiento,
+    t.Fecha_Inicio,
+    t.Fecha_Fin,
+    d.ID_Diagnóstico,
+    d.Descripción as descripcion_diagnostico
+FROM Historial_Médico h
+JOIN Diagnóstico d ON d.ID_Historial = h.ID_Historial
+JOIN Tratamiento t ON t.ID_Diagnóstico = d.ID_Diagnóstico
+JOIN Medicamento m ON m.ID_Tratamiento = t.ID_Tratamiento
+WHERE h.ID_Paciente = %s
+  AND (t.Fecha_Fin IS NULL OR t.Fecha_Fin >= CURDATE())
+ORDER BY t.Fecha_Inicio DESC, m.ID_Medicamento
+"""
+
+
+def _tabla_version(paciente_id):
+    return f"Medicamentos:{paciente_id}"
+
+
+def _clave_activos(paciente_id, version):
+    return f"medicamentos_activos:{paciente_id}:{version}:{date.today().isoformat()}"
+
+
+def _nombre_medicamento(nombre):
+    return ' '.join(normalizar(nombre).split())
+
+
+class ReglasInteraccion:
+    """Pares de medicamentos que interactúan, leídos de Interaccion_Medicamento.
+
+    Cada regla se guarda bajo el par no ordenado de nombres normalizados, así
+    comprobar un medicamento nuevo contra k activos son k búsquedas en un dict.
+    Se recarga cuando cambia la versión de 'Interaccion_Medicamento' en
+    Version_Tabla, consultada como máximo cada `intervalo` segundos.
+    """
+
+    def __init__(self, intervalo=5):
+        self._lock = threading.Lock()
+        self._intervalo = intervalo
+        self._pares = {}
+        self._version = None
+        self._ultimo_chequeo = 0
+
+    def invalidar(self):
+        with self._lock:
+            self._version = None
+
+    def _vigente(self, cursor):
+        if self._version is None:
+            return False
+        if time.monotonic() - self._ultimo_chequeo < self._intervalo:
+            return True
+        self._ultimo_chequeo = time.monotonic()
+        return leer_version(cursor, 'Interaccion_Medicamento') == self._version
+
+    def asegurar_vigente(self, cursor):
+        with self._lock:
+            if self._vigente(cursor):
+                return
+            version = leer_version(cursor, 'Interaccion_Medicamento')
+            cursor.execute("SELECT Medicamento_A, Medicamento_B, Severidad, Descripción FROM Interaccion_Medicamento")
+            pares = {}
+            for fila in cursor.fetchall():
+                if isinstance(fila, dict):
+                    fila = (fila['Medicamento_A'], fila['Medicamento_B'], fila['Severidad'], fila['Descripción'])
+                a, b, severidad, descripcion = fila
+                pares[frozenset((_nombre_medicamento(a), _nombre_medicamento(b)))] = (severidad, descripcion)
+            self._pares = pares
+            self._version = version
+            self._ultimo_chequeo = time.monotonic()
+            app.logger.info(f"Drug interaction rules loaded: {len(pares)} (version {version})")
+
+    def advertencias(self, nuevos, activos):
+        """Interacciones de cada nombre en `nuevos` con `activos` y con los otros nuevos."""
+        pares = self._pares
+        resultado = []
+        vistos = [(nombre, _nombre_medicamento(nombre)) for nombre in activos]
+        for nombre in nuevos:
+            clave = _nombre_medicamento(nombre)
+            for otro, clave_otro in vistos:
+                regla = pares.get(frozenset((clave, clave_otro)))
+                if regla:
+                    resultado.append({
+                        'medicamento': nombre,
+                        'interactua_con': otro,
+                        'severidad': regla[0],
+                        'descripcion': regla[1]
+                    })
+            vistos.append((nombre, clave))
+        return resultado
+
+
+reglas_interaccion = ReglasInteraccion()
+
+
+def paciente_de(cursor, id_diagnostico=None, id_tratamiento=None):
+    """ID_Paciente dueño del diagnóstico o tratamiento, o None si no existe."""
+    if id_tratamiento is not None:
+        cursor.execute("""
+        SELECT h.ID_Paciente
+        FROM Tratamiento t
+        JOIN Diagnóstico d ON t.ID_Diagnóstico = d.ID_Diagnóstico
+        JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+        WHERE t.ID_Tratamiento = %s
+        """, (id_tratamiento,))
+    else:
+        cursor.execute("""
+        SELECT h.ID_Paciente
+        FROM Diagnóstico d
+        JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+        WHERE d.ID_Diagnóstico = %s
+        """, (id_diagnostico,))
+    fila = cursor.fetchone()
+    if not fila:
+        return None
+    return fila['ID_Paciente'] if isinstance(fila, dict) else fila[0]
+
+
+def invalidar_medicamentos_activos(cursor, paciente_id):
+    """Sube la versión de los medicamentos del paciente; llamar en la transacción de la receta."""
+    if paciente_id is not None:
+        incrementar_version(cursor, _tabla_version(paciente_id))
+
+
+def medicamentos_activos(cursor, paciente_id):
+    """Medicamentos activos del paciente, desde la caché si la versión no cambió."""
+    clave = _clave_activos(paciente_id, leer_version(cursor, _tabla_version(paciente_id)))
+    medicamentos = cache.get(clave)
+    if medicamentos is not None:
+        return medicamentos
+    medicamentos = consultar_medicamentos_activos(cursor, paciente_id)
+    cache.set(clave, medicamentos, timeout=MEDICAMENTOS_ACTIVOS_TTL)
+    return medicamentos
+
+
+def consultar_medicamentos_activos(cursor, paciente_id):
+    """Medicamentos activos del paciente leídos de la base de datos con un solo join."""
+    cursor.execute(MEDICAMENTOS_ACTIVOS_SQL, (paciente_id,))
+    medicamentos = [
+        fila if isinstance(fila, dict) else dict(zip(cursor.column_names, fila))
+        for fila in cursor.fetchall()
+    ]
+    for medicamento in medicamentos:
+        for campo in ('Fecha_Inicio', 'Fecha_Fin'):
+            if medicamento[campo]:
+                medicamento[campo] = medicamento[campo].strftime('%Y-%m-%d')
+    return medicamentos
+
+
+def verificar_interacciones(cursor, paciente_id, nombres):
+    """Advertencias de interacción de los medicamentos `nombres` para el paciente.
+
+    Los activos se leen de la base y no de la caché: la receta que se está
+    guardando tiene que compararse con lo último que se recetó.
+    """
+    reglas_interaccion.asegurar_vigente(cursor)
+    activos = [medicamento['Nombre'] for medicamento in consultar_medicamentos_activos(cursor, paciente_id)]
+    return reglas_interaccion.advertencias(nombres, activos)
 
 
 @app.route('/medicamentos', methods=['POST'])
-@jwt_required()
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def create_medicamento():
     cursor = None
@@ -23,9 +200,15 @@ def create_medicamento():
         if missing_fields:
             return jsonify({'error': f'Missing fields: {", ".join(missing_fields)}'}), 400
         
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
         
+        paciente_id = paciente_de(cursor, id_tratamiento=data['id_tratamiento'])
+        if paciente_id is None:
+            return jsonify({'error': 'Treatment not found'}), 404
+        # Las interacciones no bloquean el alta; vuelven como advertencias
+        advertencias = verificar_interacciones(cursor, paciente_id, [data['nombre']])
+        
         query = """
         INSERT INTO Medicamento (Nombre, Dosis, ID_Tratamiento)
         VALUES (%s, %s, %s)
@@ -33,9 +216,55 @@ def create_medicamento():
         
         values = (data['nombre'], data['dosis'], data['id_tratamiento'])
         cursor.execute(query, values)
+        medicamento_id = cursor.lastrowid
+        invalidar_medicamentos_activos(cursor, paciente_id)
+        connection.commit()
+        
+        return jsonify({
+            'message': 'Medicamento creado exitosamente',
+            'id': medicamento_id,
+            'advertencias': advertencias
+        }), 201
+        
+    except mysql.connector.Error as error:
+        return jsonify({'error': f'Database error: {str(error)}'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@app.route('/interacciones', methods=['POST'])
+@requiere_rol(ADMIN, MEDICO)
+@cross_origin()
+def create_interaccion():
+    cursor = None
+    connection = None
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({'error': 'No data provided'}), 400
+        
+        required_fields = ['medicamento_a', 'medicamento_b']
+        missing_fields = [field for field in required_fields if not data.get(field)]
+        if missing_fields:
+            return jsonify({'error': f'Missing fields: {", ".join(missing_fields)}'}), 400
+        
+        connection = conectar()
+        cursor = connection.cursor()
+        
+        cursor.execute("""
+        INSERT INTO Interaccion_Medicamento (Medicamento_A, Medicamento_B, Severidad, Descripción)
+        VALUES (%s, %s, %s, %s)
+        """, (data['medicamento_a'], data['medicamento_b'], data.get('severidad', 'moderada'), data.get('descripcion')))
+        interaccion_id = cursor.lastrowid
+        incrementar_version(cursor, 'Interaccion_Medicamento')
         connection.commit()
+        reglas_interaccion.invalidar()
         
-        return jsonify({'message': 'Medicamento creado exitosamente', 'id': cursor.lastrowid}), 201
+        return jsonify({'message': 'Interacción creada exitosamente', 'id': interaccion_id}), 201
         
     except mysql.connector.Error as error:
         return jsonify({'error': f'Database error: {str(error)}'}), 500
@@ -45,6 +274,20 @@ def create_medicamento():
         if connection:
             connection.close()
 
+
+@app.cli.command('recargar-interacciones')
+def recargar_interacciones():
+    """Hace que todos los procesos relean Interaccion_Medicamento (tras editarla a mano)."""
+    connection = conectar()
+    cursor = connection.cursor()
+    try:
+        incrementar_version(cursor, 'Interaccion_Medicamento')
+        connection.commit()
+        click.echo("Reglas de interacción marcadas para recargar")
+    finally:
+        cursor.close()
+        connection.close()
+
 @app.route('/medicamentos/tratamiento/<int:tratamiento_id>', methods=['GET'])
 @jwt_required()
 @cross_origin()
@@ -52,7 +295,7 @@ def get_medicamentos_tratamiento(tratamiento_id):
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
         query = """
@@ -72,4 +315,32 @@ def get_medicamentos_tratamiento(tratamiento_id):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
\ No newline at end of file
+            connection.close()
+
+
+@app.route('/pacientes/<int:paciente_id>/medicamentos-activos', methods=['GET'])
+@jwt_required()
+@cross_origin()
+def get_medicamentos_activos(paciente_id):
+    cursor = None
+    connection = None
+    try:
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+        
+        medicamentos = medicamentos_activos(cursor, paciente_id)
+        if not medicamentos:
+            cursor.execute("SELECT 1 FROM Paciente WHERE ID_Paciente = %s", (paciente_id,))
+            if not cursor.fetchone():
+                return jsonify({'error': 'Patient not found'}), 404
+        
+        return jsonify({'id_paciente': paciente_id, 'medicamentos': medicamentos})
+        
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error in get_medicamentos_activos: {error}")
+        return jsonify({'error': 'Database error'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
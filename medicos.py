@@ -1,13 +1,120 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_jwt_extended import jwt_required
 from flask_cors import cross_origin
+from itsdangerous import BadSignature, URLSafeSerializer
 import mysql.connector
-from datetime import datetime
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from datetime import date
-from db import app, db_config
+from db import app
+from db.conexion import conectar
+from citas import filtrar_citas, ORDENES_CITA
+from db.consultas import Consulta, sentencia_update, PREFIJO
+from db.busqueda import normalizar, tokenizar
+from db.versiones import incrementar_version, leer_version
+from roles import requiere_rol, ADMIN, MEDICO
+
+FILTROS_MEDICO = {
+    'nombre': ('Nombre', PREFIJO)
+}
+ORDENES_MEDICO = {
+    'nombre': [('Nombre', 'Nombre'), ('ID_Médico', 'ID_Médico')],
+    'id': [('ID_Médico', 'ID_Médico')]
+}
+PACIENTES_MEDICO_LIMITE = 100
+PACIENTES_MEDICO_LIMITE_MAX = 500
+ORDENES_PACIENTES_MEDICO = {
+    # Columnas sin agregar: el keyset por nombre va a WHERE y no obliga a agrupar todo el panel
+    'nombre': [('p.Nombre', 'name'), ('p.ID_Paciente', 'patientId')],
+    'ultima_visita': [('orden_visita', 'orden_visita'), ('patientId', 'patientId')],
+    'citas': [('appointmentCount', 'appointmentCount'), ('patientId', 'patientId')]
+}
+CAMPOS_MEDICO = {
+    'name': 'Nombre',
+    'specialty': 'Especialidad',
+    'phone': 'Teléfono'
+}
+
+# Duración asumida de cada cita en el feed iCalendar
+DURACION_CITA = timedelta(minutes=30)
+ESTADOS_ICS = {
+    'Pendiente': 'TENTATIVE',
+    'Confirmada': 'CONFIRMED',
+    'Cancelada': 'CANCELLED'
+}
+
+class DirectorioMedicos:
+    """Copia en memoria de la tabla Médico agrupada por especialidad.
+
+    Se recarga cuando este proceso la invalida o cuando la versión de 'Médico'
+    en Version_Tabla cambia; la versión se consulta como máximo cada
+    `intervalo` segundos.
+    """
+
+    def __init__(self, intervalo=5):
+        self._lock = threading.Lock()
+        self._intervalo = intervalo
+        self._por_especialidad = {}
+        self._version = None
+        self._ultimo_chequeo = 0
+
+    def invalidar(self):
+        with self._lock:
+            self._version = None
+
+    def requiere_consulta(self):
+        """True si hay que ir a la base de datos (sin cargar o intervalo vencido)."""
+        return self._version is None or time.monotonic() - self._ultimo_chequeo >= self._intervalo
+
+    def _vigente(self, cursor):
+        if self._version is None:
+            return False
+        if time.monotonic() - self._ultimo_chequeo < self._intervalo:
+            return True
+        self._ultimo_chequeo = time.monotonic()
+        return leer_version(cursor, 'Médico') == self._version
+
+    def asegurar_vigente(self, cursor):
+        with self._lock:
+            if self._vigente(cursor):
+                return
+            # Versión antes de leer la tabla: un cambio concurrente fuerza otra recarga
+            version = leer_version(cursor, 'Médico')
+            cursor.execute("SELECT * FROM Médico ORDER BY Nombre")
+            por_especialidad = {}
+            for medico in cursor.fetchall():
+                entrada = (tokenizar(medico['Nombre']), medico)
+                por_especialidad.setdefault(normalizar(medico['Especialidad']).strip(), []).append(entrada)
+            self._por_especialidad = por_especialidad
+            self._version = version
+            self._ultimo_chequeo = time.monotonic()
+            app.logger.info(f"Doctor directory loaded (version {version})")
+
+    def buscar(self, especialidad=None, q=None):
+        """Médicos de la especialidad cuyos nombres contienen palabras que empiezan con cada término de q."""
+        with self._lock:
+            if especialidad:
+                grupos = [self._por_especialidad.get(normalizar(especialidad).strip(), [])]
+            else:
+                grupos = list(self._por_especialidad.values())
+        terminos = tokenizar(q) if q else []
+        resultado = []
+        for grupo in grupos:
+            for tokens, medico in grupo:
+                if all(any(token.startswith(termino) for token in tokens) for termino in terminos):
+                    resultado.append(medico)
+        if len(grupos) > 1:
+            resultado.sort(key=lambda medico: normalizar(medico['Nombre']))
+        return resultado
+
+
+directorio_medicos = DirectorioMedicos()
+
 
 @app.route('/medicos', methods=['POST'])
-@jwt_required()
+@requiere_rol(ADMIN)
 @cross_origin()
 def create_medico():
     cursor = None
@@ -23,7 +130,7 @@ def create_medico():
         if missing_fields:
             return jsonify({'error': f'Missing fields: {", ".join(missing_fields)}'}), 400
         
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
         
         query = """
@@ -33,9 +140,12 @@ def create_medico():
         
         values = (data['nombre'], data['especialidad'], data['telefono'])
         cursor.execute(query, values)
+        medico_id = cursor.lastrowid
+        incrementar_version(cursor, 'Médico')
         connection.commit()
+        directorio_medicos.invalidar()
         
-        return jsonify({'message': 'Médico creado exitosamente', 'id': cursor.lastrowid}), 201
+        return jsonify({'message': 'Médico creado exitosamente', 'id': medico_id}), 201
         
     except mysql.connector.Error as error:
         return jsonify({'error': f'Database error: {str(error)}'}), 500
@@ -52,14 +162,30 @@ def get_medicos():
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
+        # Búsqueda por especialidad y nombre: se responde desde el directorio en memoria
+        if 'especialidad' in request.args or 'q' in request.args:
+            if directorio_medicos.requiere_consulta():
+                connection = conectar()
+                cursor = connection.cursor(dictionary=True)
+                directorio_medicos.asegurar_vigente(cursor)
+            medicos = directorio_medicos.buscar(request.args.get('especialidad'), request.args.get('q'))
+            return jsonify({'medicos': medicos, 'count': len(medicos)})
+        
+        consulta = Consulta("SELECT * FROM Médico")
+        try:
+            consulta.filtrar(request.args, FILTROS_MEDICO)
+            consulta.ordenar(request.args.get('orden'), ORDENES_MEDICO, 'nombre')
+            consulta.paginar(request.args.get('limite'), request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
-        query = "SELECT * FROM Médico ORDER BY Nombre"
-        cursor.execute(query)
-        medicos = cursor.fetchall()
+        cursor.execute(*consulta.sql())
+        medicos, siguiente_cursor = consulta.paginar_resultado(cursor.fetchall())
         
-        return jsonify({'medicos': medicos})
+        return jsonify({'medicos': medicos, 'siguiente_cursor': siguiente_cursor})
         
     except mysql.connector.Error as error:
         return jsonify({'error': f'Database error: {str(error)}'}), 500
@@ -71,71 +197,65 @@ def get_medicos():
 
 
 @app.route('/medicos/<int:medico_id>/pacientes', methods=['GET'])
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def get_patients_by_doctor(medico_id):
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor(dictionary=True)
+        # Edad, género y fechas se calculan en SQL; la página sale lista para serializar
+        consulta = Consulta("""
+        SELECT
+            p.ID_Paciente AS patientId,
+            p.Nombre AS name,
+            DATE_FORMAT(p.Fecha_Nacimiento, '%Y-%m-%d') AS birthDate,
+            CASE p.Género
+                WHEN 'Masculino' THEN 'Male'
+                WHEN 'Femenino' THEN 'Female'
+                WHEN 'Otro' THEN 'Other'
+                ELSE p.Género
+            END AS gender,
+            p.Teléfono AS phone,
+            TIMESTAMPDIFF(YEAR, p.Fecha_Nacimiento, CURDATE()) AS age,
+            COUNT(c.ID_Cita) AS appointmentCount,
+            DATE_FORMAT(MAX(CASE WHEN c.Fecha <= CURDATE() THEN c.Fecha END), '%Y-%m-%d') AS lastVisit,
+            COALESCE(MAX(CASE WHEN c.Fecha <= CURDATE() THEN c.Fecha END), '1000-01-01') AS orden_visita
+        FROM Cita c
+        JOIN Paciente p ON c.ID_Paciente = p.ID_Paciente
+        """)
+        consulta.donde("c.ID_Médico = %s", medico_id)
+        consulta.agrupar("p.ID_Paciente", agregados=('appointmentCount', 'orden_visita'))
+        try:
+            consulta.ordenar(request.args.get('orden'), ORDENES_PACIENTES_MEDICO, 'nombre')
+            # Paginación opcional: sin limite ni cursor se devuelve el panel completo
+            limite = request.args.get('limite')
+            if not limite and request.args.get('cursor'):
+                limite = PACIENTES_MEDICO_LIMITE
+            consulta.paginar(limite, request.args.get('cursor'), limite_max=PACIENTES_MEDICO_LIMITE_MAX)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # First verify the doctor exists
-        cursor.execute("SELECT ID_Médico FROM Médico WHERE ID_Médico = %s", (medico_id,))
-        if not cursor.fetchone():
-            return jsonify({'error': 'Doctor not found'}), 404
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
         
-        query = """
-        SELECT DISTINCT
-            p.ID_Paciente,
-            p.Nombre,
-            p.Fecha_Nacimiento,
-            p.Género,
-            p.Teléfono,
-            COUNT(c.ID_Cita) AS total_citas
-        FROM Paciente p
-        JOIN Cita c ON p.ID_Paciente = c.ID_Paciente
-        WHERE c.ID_Médico = %s
-        GROUP BY p.ID_Paciente
-        ORDER BY p.Nombre
-        """
-        cursor.execute(query, (medico_id,))
-        patients = cursor.fetchall()
+        cursor.execute(*consulta.sql())
+        result, siguiente_cursor = consulta.paginar_resultado(cursor.fetchall())
         
-        # Process each patient
-        result = []
-        today = date.today()
+        # Solo si no hay filas hace falta distinguir médico inexistente de panel vacío
+        if not result and not request.args.get('cursor'):
+            cursor.execute("SELECT ID_Médico FROM Médico WHERE ID_Médico = %s", (medico_id,))
+            if not cursor.fetchone():
+                return jsonify({'error': 'Doctor not found'}), 404
         
-        for patient in patients:
-            # Calculate age
-            age = None
-            if patient['Fecha_Nacimiento']:
-                birth_date = patient['Fecha_Nacimiento']
-                age = today.year - birth_date.year
-                if (today.month, today.day) < (birth_date.month, birth_date.day):
-                    age -= 1
-            
-            # Translate gender
-            gender_map = {
-                'Masculino': 'Male',
-                'Femenino': 'Female',
-                'Otro': 'Other'
-            }
-            
-            result.append({
-                'patientId': patient['ID_Paciente'],
-                'name': patient['Nombre'],
-                'birthDate': patient['Fecha_Nacimiento'].strftime('%Y-%m-%d') if patient['Fecha_Nacimiento'] else None,
-                'gender': gender_map.get(patient['Género'], patient['Género']),
-                'phone': patient['Teléfono'],
-                'age': age,
-                'appointmentCount': patient['total_citas']
-            })
+        for patient in result:
+            patient.pop('orden_visita')
         
         return jsonify({
             'success': True,
             'medicoId': medico_id,
             'patients': result,
-            'count': len(result)
+            'count': len(result),
+            'siguiente_cursor': siguiente_cursor
         })
         
     except mysql.connector.Error as error:
@@ -152,12 +272,13 @@ def get_patients_by_doctor(medico_id):
 
 
 @app.route('/medicos/<int:medico_id>', methods=['GET'])
+@jwt_required()
 @cross_origin()
 def get_medico(medico_id):
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
         query = """
@@ -204,6 +325,7 @@ def get_medico(medico_id):
 
 
 @app.route('/medicos/<int:medico_id>', methods=['PUT'])
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def update_medico(medico_id):
     cursor = None
@@ -226,7 +348,7 @@ def update_medico(medico_id):
                 'error': f'Missing required fields: {", ".join(missing_fields)}'
             }), 400
 
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
 
         # Verify doctor exists
@@ -238,23 +360,10 @@ def update_medico(medico_id):
             }), 404
 
         # Update doctor information (removed Correo field)
-        update_query = """
-        UPDATE Médico 
-        SET 
-            Nombre = %s,
-            Especialidad = %s,
-            Teléfono = %s
-        WHERE ID_Médico = %s
-        """
-        values = (
-            data['name'],
-            data['specialty'],
-            data['phone'],
-            medico_id
-        )
-        
-        cursor.execute(update_query, values)
+        cursor.execute(*sentencia_update('Médico', CAMPOS_MEDICO, data, 'ID_Médico', medico_id))
+        incrementar_version(cursor, 'Médico')
         connection.commit()
+        directorio_medicos.invalidar()
 
         # Get the updated doctor record (removed email from SELECT)
         cursor.execute("""
@@ -294,4 +403,188 @@ def update_medico(medico_id):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
\ No newline at end of file
+            connection.close()
+
+
+def _ics_texto(valor):
+    """Escapa un valor de texto según RFC 5545."""
+    # Un \r suelto cortaría la línea de contenido: todo salto de línea pasa a \n
+    valor = str(valor or '').replace('\r\n', '\n').replace('\r', '\n')
+    return (valor.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _ics_linea(linea):
+    """Pliega una línea de contenido a 75 octetos como exige RFC 5545."""
+    datos = linea.encode('utf-8')
+    partes = []
+    while len(datos) > 75:
+        corte = 75 if not partes else 74
+        # No partir un carácter multibyte a la mitad
+        while corte > 0 and (datos[corte] & 0xC0) == 0x80:
+            corte -= 1
+        partes.append(datos[:corte].decode('utf-8'))
+        datos = datos[corte:]
+    partes.append(datos.decode('utf-8'))
+    return '\r\n '.join(partes) + '\r\n'
+
+
+def _firmante_agenda():
+    # Firmado con la clave del JWT; el salt evita que sirva como otro tipo de token
+    return URLSafeSerializer(app.config['JWT_SECRET_KEY'], salt='agenda-ics')
+
+
+def token_agenda(medico_id):
+    """Token del feed iCalendar de un médico, para la URL de suscripción."""
+    return _firmante_agenda().dumps(medico_id)
+
+
+def _token_agenda_valido(token, medico_id):
+    try:
+        return _firmante_agenda().loads(token) == medico_id
+    except BadSignature:
+        return False
+
+
+@app.route('/medicos/<int:medico_id>/agenda-token', methods=['GET'])
+@requiere_rol(ADMIN, MEDICO)
+@cross_origin()
+def get_agenda_token(medico_id):
+    token = token_agenda(medico_id)
+    return jsonify({
+        'token': token,
+        'url': f"{request.host_url}medicos/{medico_id}/agenda.ics?token={token}"
+    })
+
+
+def _stream_agenda_ics(connection, cursor, doctor):
+    """Genera el calendario fila a fila desde un cursor sin buffer."""
+    try:
+        ahora = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        yield _ics_linea('BEGIN:VCALENDAR')
+        yield _ics_linea('VERSION:2.0')
+        yield _ics_linea('PRODID:-//Historial Medico//Agenda//ES')
+        yield _ics_linea('CALSCALE:GREGORIAN')
+        yield _ics_linea(f"X-WR-CALNAME:{_ics_texto('Agenda ' + doctor['Nombre'])}")
+
+        for cita in cursor:
+            inicio = datetime.combine(cita['Fecha'], datetime.min.time()) + cita['Hora']
+            fin = inicio + DURACION_CITA
+            yield _ics_linea('BEGIN:VEVENT')
+            yield _ics_linea(f"UID:cita-{cita['ID_Cita']}@historial-medico")
+            yield _ics_linea(f"DTSTAMP:{ahora}")
+            yield _ics_linea(f"DTSTART:{inicio.strftime('%Y%m%dT%H%M%S')}")
+            yield _ics_linea(f"DTEND:{fin.strftime('%Y%m%dT%H%M%S')}")
+            yield _ics_linea(f"SUMMARY:{_ics_texto('Cita con ' + cita['nombre_paciente'])}")
+            yield _ics_linea(f"DESCRIPTION:{_ics_texto('Teléfono: ' + str(cita['Teléfono'] or ''))}")
+            yield _ics_linea(f"STATUS:{ESTADOS_ICS.get(cita['Estado'], 'TENTATIVE')}")
+            yield _ics_linea('END:VEVENT')
+
+        yield _ics_linea('END:VCALENDAR')
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error streaming agenda for doctor {doctor['ID_Médico']}: {error}")
+    finally:
+        # Si el cliente corta la descarga pueden quedar filas sin leer
+        try:
+            cursor.close()
+            connection.close()
+        except Exception as cleanup_error:
+            app.logger.error(f"Error closing agenda stream: {str(cleanup_error)}")
+
+
+@app.route('/medicos/<int:medico_id>/agenda.ics', methods=['GET'])
+@cross_origin()
+def get_agenda_ics(medico_id):
+    cursor = None
+    connection = None
+    try:
+        # Los clientes de calendario no envían Authorization: el feed pide un token firmado
+        if not _token_agenda_valido(request.args.get('token', ''), medico_id):
+            return jsonify({'error': 'Invalid or missing feed token'}), 403
+
+        # Sin `desde` el feed incluye los últimos 30 días (hasta `hasta`, o todo lo próximo)
+        args = request.args.to_dict()
+        if not args.get('desde'):
+            args['desde'] = (date.today() - timedelta(days=30)).strftime('%Y-%m-%d')
+        # El feed muestra nombre y teléfono del paciente: sus cambios también invalidan
+        validacion = Consulta("""
+        SELECT COUNT(*) AS total,
+               UNIX_TIMESTAMP(GREATEST(MAX(c.Actualizado), MAX(p.Actualizado))) AS ultima
+        FROM Cita c
+        JOIN Paciente p ON c.ID_Paciente = p.ID_Paciente
+        """)
+        agenda = Consulta("""
+        SELECT
+            c.ID_Cita,
+            c.Fecha,
+            c.Hora,
+            c.Estado,
+            p.Nombre as nombre_paciente,
+            p.Teléfono
+        FROM Cita c
+        JOIN Paciente p ON c.ID_Paciente = p.ID_Paciente
+        """)
+        try:
+            for consulta in (validacion, agenda):
+                consulta.donde("c.ID_Médico = %s", medico_id)
+                filtros = filtrar_citas(consulta, args)
+            agenda.ordenar('fecha', ORDENES_CITA, 'fecha')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True, buffered=True)
+
+        cursor.execute("SELECT ID_Médico, Nombre FROM Médico WHERE ID_Médico = %s", (medico_id,))
+        doctor = cursor.fetchone()
+        if not doctor:
+            return jsonify({'error': 'Doctor not found'}), 404
+
+        # Validador barato: recorre el rango de citas por índice y lee cada paciente por clave primaria
+        cursor.execute(*validacion.sql())
+        validador = cursor.fetchone()
+        ultima = None
+        if validador['ultima'] is not None:
+            ultima = datetime.fromtimestamp(int(validador['ultima']), timezone.utc)
+
+        # El nombre del médico va en X-WR-CALNAME y Médico no tiene marca de modificación
+        etag = hashlib.sha1(
+            f"{medico_id}:{doctor['Nombre']}:{filtros}:{validador['total']}:{validador['ultima']}".encode('utf-8')
+        ).hexdigest()
+
+        no_modificado = request.if_none_match.contains(etag)
+        if not request.if_none_match and request.if_modified_since and ultima:
+            no_modificado = ultima <= request.if_modified_since
+        if no_modificado:
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
+        cursor.close()
+        # Cursor sin buffer: las filas se leen del servidor a medida que se envían
+        cursor = connection.cursor(dictionary=True, buffered=False)
+        cursor.execute(*agenda.sql())
+
+        stream = _stream_agenda_ics(connection, cursor, doctor)
+        # El generador es ahora responsable de cerrar el cursor y la conexión
+        cursor = None
+        connection = None
+
+        response = Response(stream, mimetype='text/calendar')
+        response.headers['Content-Disposition'] = f'inline; filename="agenda-{medico_id}.ics"'
+        response.set_etag(etag)
+        if ultima:
+            response.last_modified = ultima
+        return response
+
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error in get_agenda_ics: {error}")
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        app.logger.error(f"Unexpected error in get_agenda_ics: {e}")
+        return jsonify({'error': 'Unexpected error'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
@@ -0,0 +1,90 @@
+from flask import Response, g, jsonify, request
+import hmac
+import time
+from db import app
+from db.instrumentacion import filas, repetidas
+from db.metricas import etiquetas, metricas
+
+
+def _etiquetas_request():
+    # La regla (/pacientes/<int:paciente_id>) y no la URL, para acotar las series
+    ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+    return etiquetas(ruta=ruta, metodo=request.method)
+
+
+@app.before_request
+def iniciar_medicion():
+    g.inicio_request = time.perf_counter()
+    g.etiquetas_request = _etiquetas_request()
+    metricas.sumar_gauge('http_requests_in_flight', g.etiquetas_request)
+
+
+def _revisar_consultas(consultas, ruta):
+    lenta_ms = app.config['SQL_LENTA_MS']
+    for consulta in consultas:
+        if consulta['duracion'] * 1000 > lenta_ms:
+            app.logger.warning(
+                f"Slow query in {ruta}: {consulta['duracion'] * 1000:.1f} ms, "
+                f"{filas(consulta)} rows: {consulta['sql']}"
+            )
+    for sql, veces in repetidas(consultas, app.config['SQL_REPETICIONES_MAX']):
+        app.logger.warning(f"Possible N+1 in {ruta}: {veces} executions of: {sql}")
+
+
+def _server_timing(consultas):
+    total_ms = sum(consulta['duracion'] for consulta in consultas) * 1000
+    partes = [f'db;dur={total_ms:.1f};desc="{len(consultas)} consultas"']
+    if consultas:
+        lenta_ms = max(consulta['duracion'] for consulta in consultas) * 1000
+        partes.append(f'db-max;dur={lenta_ms:.1f}')
+        partes.append(f'db-filas;desc="{sum(filas(consulta) for consulta in consultas)}"')
+    inicio = g.get('inicio_request')
+    if inicio is not None:
+        partes.append(f'app;dur={(time.perf_counter() - inicio) * 1000:.1f}')
+    return ', '.join(partes)
+
+
+@app.after_request
+def registrar_estado(response):
+    g.estado_request = response.status_code
+    # Sentencias de este request anotadas por los cursores de conectar()
+    consultas = g.pop('consultas', [])
+    ruta = f"{request.method} {request.path}"
+    response.headers['Server-Timing'] = _server_timing(consultas)
+    if response.is_streamed:
+        # El generador sigue ejecutando y leyendo filas después de este punto (la
+        # lista es la misma que recibe sus cursores): se revisa al cerrar la respuesta.
+        # Server-Timing ya salió con los encabezados y solo cubre lo previo al stream.
+        response.call_on_close(lambda: _revisar_consultas(consultas, ruta))
+    else:
+        _revisar_consultas(consultas, ruta)
+    return response
+
+
+@app.teardown_request
+def terminar_medicion(error=None):
+    inicio = g.pop('inicio_request', None)
+    if inicio is None:
+        return
+    # En respuestas en streaming mide hasta que el endpoint devuelve la respuesta
+    duracion = time.perf_counter() - inicio
+    base = g.pop('etiquetas_request')
+    estado = 500 if error is not None else g.pop('estado_request', 500)
+    metricas.sumar_gauge('http_requests_in_flight', base, -1)
+    metricas.observar('http_request_duration_seconds', base, duracion)
+    metricas.incrementar('http_requests_total', f'{base},estado="{estado}"')
+    try:
+        metricas.volcar()
+    except OSError as e:
+        app.logger.error(f"Error writing metrics file: {e}")
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Un token fijo y no JWT: el scraper de Prometheus no renueva tokens que vencen
+    token = app.config['METRICAS_TOKEN']
+    if token:
+        enviado = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(enviado.encode('utf-8'), token.encode('utf-8')):
+            return jsonify({'error': 'Invalid metrics token'}), 401
+    return Response(metricas.texto(), mimetype='text/plain; version=0.0.4')
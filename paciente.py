@@ -2,13 +2,63 @@ from flask import Flask, request, jsonify
 from flask_jwt_extended import jwt_required
 from flask_cors import cross_origin
 import mysql.connector  
-from db import app, db_config
+import click
+import csv
+import io
+import json
+from db import app
+from db.conexion import conectar
+from db.lotes import cargar_en_lote
+from db.consultas import Consulta, sentencia_update, IGUAL, FECHA, PREFIJO
+from db.identidad import GENEROS, clave_identidad, buscar_duplicado
+from roles import requiere_rol, ADMIN, MEDICO
 from datetime import datetime
 
+# Diagnósticos por página en el timeline del paciente
+TIMELINE_LIMITE = 50
+TIMELINE_LIMITE_MAX = 200
+ORDENES_TIMELINE = {
+    # fecha_orden es d.Fecha sin formatear: el cursor debe compararse con el valor de la columna
+    'fecha': [('d.Fecha', 'fecha_orden'), ('d.ID_Diagnóstico', 'ID_Diagnóstico')]
+}
+
+FILTROS_PACIENTE = {
+    'nombre': ('Nombre', PREFIJO),
+    'genero': ('Género', IGUAL)
+}
+ORDENES_PACIENTE = {
+    'nombre': [('Nombre', 'Nombre'), ('ID_Paciente', 'ID_Paciente')],
+    'id': [('ID_Paciente', 'ID_Paciente')]
+}
+# Búsqueda sobre las columnas calculadas de la migración 008
+BUSQUEDA_PACIENTE_LIMITE = 20
+BUSQUEDA_PACIENTE_LIMITE_MAX = 100
+FILTROS_BUSQUEDA_PACIENTE = {
+    'q': ('Nombre_Busqueda', PREFIJO),
+    'telefono': ('Telefono_Normalizado', IGUAL),
+    'fecha_nacimiento': ('Fecha_Nacimiento', FECHA)
+}
+ORDENES_BUSQUEDA_PACIENTE = {
+    'nombre': [('Nombre_Busqueda', 'nombre_busqueda'), ('ID_Paciente', 'ID_Paciente')]
+}
+# Importación masiva (POST /pacientes/importar)
+IMPORTACION_LOTE = 1000
+IMPORTACION_LOTE_MAX = 5000
+IMPORTACION_MAX_ERRORES = 1000
+# Pacientes por transacción al completar Clave_Identidad
+LOTE_IDENTIDAD = 1000
+CAMPOS_PACIENTE = {
+    'nombre': 'Nombre',
+    'fecha_nacimiento': 'Fecha_Nacimiento',
+    'genero': 'Género',
+    'telefono': 'Teléfono'
+}
+
 
 
 
 @app.route('/pacientes', methods=['POST'])
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def create_paciente():
     cursor = None
@@ -24,15 +74,25 @@ def create_paciente():
         if missing_fields:
             return jsonify({'error': f'Missing fields: {", ".join(missing_fields)}'}), 400
         
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
         
+        # Mismo nombre, fecha de nacimiento y teléfono: búsqueda por índice
+        clave = clave_identidad(data['nombre'], data['fecha_nacimiento'], data['telefono'])
+        if request.args.get('forzar') != 'true':
+            existente = buscar_duplicado(cursor, clave)
+            if existente:
+                return jsonify({
+                    'error': 'Paciente ya registrado',
+                    'id_existente': existente
+                }), 409
+        
         query = """
-        INSERT INTO Paciente (Nombre, Fecha_Nacimiento, Género, Teléfono)
-        VALUES (%s, %s, %s, %s)
+        INSERT INTO Paciente (Nombre, Fecha_Nacimiento, Género, Teléfono, Clave_Identidad)
+        VALUES (%s, %s, %s, %s, %s)
         """
         
-        values = (data['nombre'], data['fecha_nacimiento'], data['genero'], data['telefono'])
+        values = (data['nombre'], data['fecha_nacimiento'], data['genero'], data['telefono'], clave)
         cursor.execute(query, values)
         connection.commit()
         
@@ -50,25 +110,185 @@ def create_paciente():
         if connection:
             connection.close()
 
+def _filas_importacion(stream, formato):
+    """Lee el cuerpo línea a línea y genera (número_de_fila, fila o None si no se pudo leer)."""
+    texto = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if formato == 'csv':
+        for numero, fila in enumerate(csv.DictReader(texto), start=1):
+            yield numero, fila
+        return
+    for numero, linea in enumerate(texto, start=1):
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except ValueError:
+            fila = None
+        yield numero, fila if isinstance(fila, dict) else None
+
+
+def _validar_paciente(fila):
+    """Devuelve la tupla para el INSERT o lanza ValueError con el motivo."""
+    if fila is None:
+        raise ValueError('Invalid row format')
+    valores = {campo: str(fila.get(campo) or '').strip() for campo in CAMPOS_PACIENTE}
+    faltantes = [campo for campo, valor in valores.items() if not valor]
+    if faltantes:
+        raise ValueError(f'Missing fields: {", ".join(faltantes)}')
+    try:
+        datetime.strptime(valores['fecha_nacimiento'], '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"Invalid fecha_nacimiento: {valores['fecha_nacimiento']}")
+    if valores['genero'] not in GENEROS:
+        raise ValueError(f"Invalid genero: {valores['genero']} (expected one of: {', '.join(GENEROS)})")
+    return (
+        valores['nombre'], valores['fecha_nacimiento'], valores['genero'], valores['telefono'],
+        clave_identidad(valores['nombre'], valores['fecha_nacimiento'], valores['telefono'])
+    )
+
+
+@app.route('/pacientes/importar', methods=['POST'])
+@requiere_rol(ADMIN)
+@cross_origin()
+def importar_pacientes():
+    cursor = None
+    connection = None
+    try:
+        tipo = request.mimetype
+        if tipo == 'text/csv':
+            formato = 'csv'
+        elif tipo in ('application/x-ndjson', 'application/jsonl'):
+            formato = 'ndjson'
+        else:
+            return jsonify({'error': 'Content-Type must be text/csv or application/x-ndjson'}), 415
+        try:
+            tamano_lote = min(int(request.args.get('lote', IMPORTACION_LOTE)), IMPORTACION_LOTE_MAX)
+        except ValueError:
+            return jsonify({'error': f"Valor inválido para 'lote': {request.args.get('lote')}"}), 400
+        if tamano_lote < 1:
+            return jsonify({'error': "'lote' debe ser positivo"}), 400
+        
+        connection = conectar()
+        cursor = connection.cursor()
+        
+        importados = 0
+        errores = []
+        total_errores = 0
+        
+        def registrar_error(numero, mensaje):
+            nonlocal total_errores
+            total_errores += 1
+            if len(errores) < IMPORTACION_MAX_ERRORES:
+                errores.append({'fila': numero, 'error': mensaje})
+        
+        def insertar_filas(filas):
+            # Un INSERT de varias filas (executemany lo reescribe así) y su historial
+            cursor.executemany("""
+            INSERT INTO Paciente (Nombre, Fecha_Nacimiento, Género, Teléfono, Clave_Identidad)
+            VALUES (%s, %s, %s, %s, %s)
+            """, filas)
+            # Un INSERT de varias filas reserva sus ids de una vez: van de lastrowid en
+            # pasos de auto_increment_increment. El historial se crea con INSERT ... SELECT
+            # sobre ese rango, así no toca pacientes que otros confirmen entre medio
+            # (POST /pacientes no crea historial; se crea aparte con POST /historial).
+            claves = [valores[4] for valores in filas]
+            cursor.execute(f"""
+            INSERT INTO Historial_Médico (ID_Paciente, Fecha_Creación)
+            SELECT p.ID_Paciente, %s
+            FROM Paciente p
+            WHERE p.ID_Paciente BETWEEN %s AND %s + (%s - 1) * @@auto_increment_increment
+              AND p.Clave_Identidad IN ({', '.join(['%s'] * len(claves))})
+            """, [datetime.now().date(), cursor.lastrowid, cursor.lastrowid, len(filas), *claves])
+        
+        def insertar(lote):
+            # Una transacción por lote; si falla, se reintenta fila por fila para que
+            # cada fila informe su propio error y las demás se importen
+            nonlocal importados
+            try:
+                insertar_filas([valores for _, valores in lote])
+                connection.commit()
+                importados += len(lote)
+                return
+            except mysql.connector.Error as error:
+                connection.rollback()
+                app.logger.warning(f"Import batch of {len(lote)} rows failed, retrying row by row: {error}")
+            for numero, valores in lote:
+                try:
+                    insertar_filas([valores])
+                    connection.commit()
+                    importados += 1
+                except mysql.connector.Error as error:
+                    connection.rollback()
+                    # Sin conexión no tiene sentido seguir fila por fila
+                    if not connection.is_connected():
+                        raise
+                    registrar_error(numero, f'Database error: {error.msg}')
+        
+        lote = []
+        for numero, fila in _filas_importacion(request.stream, formato):
+            try:
+                lote.append((numero, _validar_paciente(fila)))
+            except ValueError as e:
+                registrar_error(numero, str(e))
+                continue
+            if len(lote) >= tamano_lote:
+                insertar(lote)
+                lote = []
+        if lote:
+            insertar(lote)
+        
+        return jsonify({
+            'success': total_errores == 0,
+            'importados': importados,
+            'total_errores': total_errores,
+            'errores': errores
+        }), 200 if importados or not total_errores else 400
+        
+    except UnicodeDecodeError:
+        # Los lotes anteriores ya quedaron confirmados
+        return jsonify({'error': 'Body must be UTF-8 encoded', 'importados': importados}), 400
+    except csv.Error as e:
+        return jsonify({'error': f'Invalid CSV: {str(e)}', 'importados': importados}), 400
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error in importar_pacientes: {error}")
+        return jsonify({'error': 'Database error'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
 @app.route('/pacientes', methods=['GET'])
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def get_pacientes():
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
+        consulta = Consulta("SELECT * FROM Paciente")
+        try:
+            consulta.filtrar(request.args, FILTROS_PACIENTE)
+            consulta.ordenar(request.args.get('orden'), ORDENES_PACIENTE, 'nombre')
+            consulta.paginar(request.args.get('limite'), request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
-        query = "SELECT * FROM Paciente ORDER BY Nombre"
-        cursor.execute(query)
-        pacientes = cursor.fetchall()
+        cursor.execute(*consulta.sql())
+        pacientes, siguiente_cursor = consulta.paginar_resultado(cursor.fetchall())
         
         # Convertir dates a string para JSON
         for paciente in pacientes:
             if paciente['Fecha_Nacimiento']:
                 paciente['Fecha_Nacimiento'] = paciente['Fecha_Nacimiento'].strftime('%Y-%m-%d')
         
-        return jsonify(pacientes)
+        response = jsonify(pacientes)
+        # La respuesta sigue siendo una lista; el cursor de la página siguiente va en un encabezado
+        if siguiente_cursor:
+            response.headers['X-Siguiente-Cursor'] = siguiente_cursor
+        return response
         
     except mysql.connector.Error as error:
         return jsonify({'error': f'Database error: {str(error)}'}), 500
@@ -78,13 +298,71 @@ def get_pacientes():
         if connection:
             connection.close()
 
+@app.route('/pacientes/buscar', methods=['GET'])
+@requiere_rol(ADMIN, MEDICO)
+@cross_origin()
+def buscar_pacientes():
+    cursor = None
+    connection = None
+    try:
+        args = {
+            'q': ' '.join(request.args.get('q', '').split()),
+            # Solo dígitos, igual que Telefono_Normalizado
+            'telefono': ''.join(c for c in request.args.get('telefono', '') if c.isdigit()),
+            'fecha_nacimiento': request.args.get('fecha_nacimiento', '').strip()
+        }
+        if not any(args.values()):
+            return jsonify({'error': 'Provide at least one of: q, telefono, fecha_nacimiento'}), 400
+        
+        consulta = Consulta("""
+        SELECT ID_Paciente, Nombre, Fecha_Nacimiento, Género, Teléfono,
+               Nombre_Busqueda AS nombre_busqueda
+        FROM Paciente
+        """)
+        try:
+            consulta.filtrar(args, FILTROS_BUSQUEDA_PACIENTE)
+            consulta.ordenar('nombre', ORDENES_BUSQUEDA_PACIENTE, 'nombre')
+            consulta.paginar(
+                request.args.get('limite', BUSQUEDA_PACIENTE_LIMITE),
+                request.args.get('cursor'),
+                limite_max=BUSQUEDA_PACIENTE_LIMITE_MAX
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+        
+        cursor.execute(*consulta.sql())
+        pacientes, siguiente_cursor = consulta.paginar_resultado(cursor.fetchall())
+        
+        for paciente in pacientes:
+            paciente.pop('nombre_busqueda')
+            if paciente['Fecha_Nacimiento']:
+                paciente['Fecha_Nacimiento'] = paciente['Fecha_Nacimiento'].strftime('%Y-%m-%d')
+        
+        return jsonify({
+            'pacientes': pacientes,
+            'siguiente_cursor': siguiente_cursor
+        })
+        
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error in buscar_pacientes: {error}")
+        return jsonify({'error': f'Database error: {str(error)}'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
 @app.route('/patients/<int:patient_id>', methods=['GET'])
+@jwt_required()
 @cross_origin()
 def get_patient(patient_id):
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
         query = """
@@ -147,6 +425,7 @@ def get_patient(patient_id):
 
 
 @app.route('/pacientes/<int:paciente_id>', methods=['PUT'])
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def update_paciente(paciente_id):
     cursor = None
@@ -158,11 +437,11 @@ def update_paciente(paciente_id):
             return jsonify({'error': 'No data provided'}), 400
             
         # Check if at least one updatable field is provided
-        updatable_fields = ['nombre', 'fecha_nacimiento', 'genero', 'telefono']
-        if not any(field in data for field in updatable_fields):
+        update = sentencia_update('Paciente', CAMPOS_PACIENTE, data, 'ID_Paciente', paciente_id)
+        if not update:
             return jsonify({'error': 'No valid fields provided for update'}), 400
         
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
         # First check if the patient exists
@@ -170,34 +449,7 @@ def update_paciente(paciente_id):
         if not cursor.fetchone():
             return jsonify({'error': 'Paciente not found'}), 404
         
-        # Build the update query dynamically based on provided fields
-        set_clauses = []
-        values = []
-        
-        if 'nombre' in data:
-            set_clauses.append("Nombre = %s")
-            values.append(data['nombre'])
-        if 'fecha_nacimiento' in data:
-            set_clauses.append("Fecha_Nacimiento = %s")
-            values.append(data['fecha_nacimiento'])
-        if 'genero' in data:
-            set_clauses.append("Género = %s")
-            values.append(data['genero'])
-        if 'telefono' in data:
-            set_clauses.append("Teléfono = %s")
-            values.append(data['telefono'])
-        
-        # Add the paciente_id to the values for the WHERE clause
-        values.append(paciente_id)
-        
-        query = f"""
-        UPDATE Paciente
-        SET {', '.join(set_clauses)}
-        WHERE ID_Paciente = %s
-        """
-        
-        cursor.execute(query, values)
-        connection.commit()
+        cursor.execute(*update)
         
         # Get the updated patient data to return
         cursor.execute("""
@@ -207,6 +459,14 @@ def update_paciente(paciente_id):
         """, (paciente_id,))
         updated_paciente = cursor.fetchone()
         
+        if any(campo in data for campo in ('nombre', 'fecha_nacimiento', 'telefono')):
+            cursor.execute(
+                "UPDATE Paciente SET Clave_Identidad = %s WHERE ID_Paciente = %s",
+                (clave_identidad(updated_paciente['Nombre'], updated_paciente['Fecha_Nacimiento'],
+                                 updated_paciente['Teléfono']), paciente_id)
+            )
+        connection.commit()
+        
         return jsonify({
             'message': 'Paciente actualizado exitosamente',
             'paciente': updated_paciente
@@ -223,4 +483,193 @@ def update_paciente(paciente_id):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
\ No newline at end of file
+            connection.close()
+
+@app.route('/pacientes/<int:paciente_id>/timeline', methods=['GET'])
+@jwt_required()
+@cross_origin()
+def get_timeline_paciente(paciente_id):
+    cursor = None
+    connection = None
+    try:
+        # Diagnósticos del más reciente al más antiguo, paginados con el cursor de Consulta
+        consulta = Consulta("""
+        SELECT 
+            d.ID_Diagnóstico,
+            d.Descripción,
+            DATE_FORMAT(d.Fecha, '%Y-%m-%d') as Fecha,
+            d.Fecha as fecha_orden,
+            d.ID_Historial,
+            d.ID_Cita,
+            DATE_FORMAT(c.Fecha, '%Y-%m-%d') as fecha_cita,
+            TIME_FORMAT(c.Hora, '%H:%i:%s') as hora_cita,
+            c.Estado as estado_cita,
+            m.ID_Médico,
+            m.Nombre as nombre_medico,
+            m.Especialidad
+        FROM Diagnóstico d
+        JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+        LEFT JOIN Cita c ON d.ID_Cita = c.ID_Cita
+        LEFT JOIN Médico m ON c.ID_Médico = m.ID_Médico
+        """).donde("h.ID_Paciente = %s", paciente_id)
+        try:
+            consulta.ordenar('-fecha', ORDENES_TIMELINE, '-fecha')
+            consulta.paginar(
+                request.args.get('limite', TIMELINE_LIMITE), request.args.get('cursor'), TIMELINE_LIMITE_MAX
+            )
+        except ValueError as e:
+            return jsonify({'error': f'Invalid pagination parameters: {str(e)}'}), 400
+        
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+        
+        # 1. Paciente
+        cursor.execute("""
+        SELECT ID_Paciente, Nombre, DATE_FORMAT(Fecha_Nacimiento, '%Y-%m-%d') as Fecha_Nacimiento,
+               Género, Teléfono
+        FROM Paciente
+        WHERE ID_Paciente = %s
+        """, (paciente_id,))
+        paciente = cursor.fetchone()
+        if not paciente:
+            return jsonify({'error': 'Patient not found'}), 404
+        
+        # 2. Historiales del paciente
+        cursor.execute("""
+        SELECT ID_Historial, DATE_FORMAT(Fecha_Creación, '%Y-%m-%d') as Fecha_Creación
+        FROM Historial_Médico
+        WHERE ID_Paciente = %s
+        ORDER BY Fecha_Creación DESC
+        """, (paciente_id,))
+        historiales = cursor.fetchall()
+        
+        # 3. Una página de diagnósticos con su cita y médico
+        cursor.execute(*consulta.sql())
+        diagnosticos, siguiente_cursor = consulta.paginar_resultado(cursor.fetchall())
+        
+        # 4. Tratamientos de todos los diagnósticos de la página
+        tratamientos = cargar_en_lote(cursor, """
+        SELECT 
+            t.ID_Tratamiento,
+            t.Descripción,
+            DATE_FORMAT(t.Fecha_Inicio, '%Y-%m-%d') as Fecha_Inicio,
+            DATE_FORMAT(t.Fecha_Fin, '%Y-%m-%d') as Fecha_Fin,
+            t.ID_Diagnóstico
+        FROM Tratamiento t
+        WHERE t.ID_Diagnóstico IN ({ids})
+        ORDER BY t.Fecha_Inicio DESC
+        """, [d['ID_Diagnóstico'] for d in diagnosticos], 'ID_Diagnóstico')
+        
+        # 5. Medicamentos de todos esos tratamientos
+        ids_tratamiento = [t['ID_Tratamiento'] for filas in tratamientos.values() for t in filas]
+        medicamentos = cargar_en_lote(cursor, """
+        SELECT m.ID_Medicamento, m.Nombre, m.Dosis, m.ID_Tratamiento
+        FROM Medicamento m
+        WHERE m.ID_Tratamiento IN ({ids})
+        """, ids_tratamiento, 'ID_Tratamiento')
+        
+        for filas in tratamientos.values():
+            for tratamiento in filas:
+                tratamiento['medicamentos'] = medicamentos.get(tratamiento['ID_Tratamiento'], [])
+        
+        diagnosticos_por_historial = {}
+        for diagnostico in diagnosticos:
+            diagnostico.pop('fecha_orden')
+            cita = None
+            if diagnostico['ID_Cita']:
+                cita = {
+                    'ID_Cita': diagnostico['ID_Cita'],
+                    'Fecha': diagnostico['fecha_cita'],
+                    'Hora': diagnostico['hora_cita'],
+                    'Estado': diagnostico['estado_cita'],
+                    'medico': {
+                        'ID_Médico': diagnostico['ID_Médico'],
+                        'Nombre': diagnostico['nombre_medico'],
+                        'Especialidad': diagnostico['Especialidad']
+                    } if diagnostico['ID_Médico'] else None
+                }
+            for field in ('fecha_cita', 'hora_cita', 'estado_cita', 'ID_Médico', 'nombre_medico', 'Especialidad'):
+                diagnostico.pop(field)
+            diagnostico['cita'] = cita
+            diagnostico['tratamientos'] = tratamientos.get(diagnostico['ID_Diagnóstico'], [])
+            diagnosticos_por_historial.setdefault(diagnostico['ID_Historial'], []).append(diagnostico)
+        
+        for historial in historiales:
+            historial['diagnosticos'] = diagnosticos_por_historial.get(historial['ID_Historial'], [])
+        
+        return jsonify({
+            'paciente': paciente,
+            'historiales': historiales,
+            'siguiente_cursor': siguiente_cursor
+        })
+        
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error in get_timeline_paciente: {error}")
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        app.logger.error(f"Unexpected error in get_timeline_paciente: {e}")
+        return jsonify({'error': 'Unexpected error'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@app.cli.command('duplicados-pacientes')
+@click.option('--lote', default=LOTE_IDENTIDAD, show_default=True,
+              help='Pacientes procesados por transacción.')
+def duplicados_pacientes(lote):
+    """Completa Clave_Identidad por lotes y lista los grupos de pacientes duplicados."""
+    connection = conectar()
+    cursor = connection.cursor()
+    try:
+        # Recorrido por clave primaria con transacciones cortas: no bloquea la tabla
+        ultimo_id = 0
+        revisados = 0
+        actualizados = 0
+        while True:
+            cursor.execute("""
+            SELECT ID_Paciente, Nombre, Fecha_Nacimiento, Teléfono, Clave_Identidad
+            FROM Paciente
+            WHERE ID_Paciente > %s
+            ORDER BY ID_Paciente
+            LIMIT %s
+            """, (ultimo_id, lote))
+            filas = cursor.fetchall()
+            if not filas:
+                break
+            cambios = []
+            for id_paciente, nombre, fecha_nacimiento, telefono, actual in filas:
+                clave = clave_identidad(nombre, fecha_nacimiento, telefono)
+                if clave != actual:
+                    cambios.append((clave, id_paciente))
+            if cambios:
+                # Actualizado = Actualizado: completar la clave no es un cambio para las exportaciones
+                cursor.executemany(
+                    "UPDATE Paciente SET Clave_Identidad = %s, Actualizado = Actualizado WHERE ID_Paciente = %s",
+                    cambios
+                )
+            connection.commit()
+            ultimo_id = filas[-1][0]
+            revisados += len(filas)
+            actualizados += len(cambios)
+            click.echo(f"{revisados} pacientes revisados", err=True)
+        click.echo(f"Claves actualizadas: {actualizados}", err=True)
+        
+        # Los grupos salen del índice de Clave_Identidad
+        cursor.execute("""
+        SELECT Clave_Identidad, GROUP_CONCAT(ID_Paciente ORDER BY ID_Paciente), MIN(Nombre)
+        FROM Paciente
+        WHERE Clave_Identidad IS NOT NULL
+        GROUP BY Clave_Identidad
+        HAVING COUNT(*) > 1
+        """)
+        grupos = 0
+        for _, ids, nombre in cursor:
+            grupos += 1
+            click.echo(f"{nombre}: {ids}")
+        click.echo(f"Grupos de duplicados: {grupos}", err=True)
+    finally:
+        cursor.close()
+        connection.close()
@@ -0,0 +1,201 @@
+from flask import jsonify
+from flask_jwt_extended import jwt_required
+from flask_cors import cross_origin
+import click
+import mysql.connector
+from datetime import date
+from db import app
+from db.conexion import conectar
+
+# Pacientes recalculados por transacción en la reconstrucción completa
+LOTE_RECONSTRUCCION = 1000
+
+# Próxima cita no cancelada del paciente; usa el índice (ID_Paciente, Fecha, Hora)
+PROXIMA_CITA_SQL = """
+(SELECT TIMESTAMP(c.Fecha, c.Hora) FROM Cita c
+ WHERE c.ID_Paciente = {paciente} AND c.Estado <> 'Cancelada'
+   AND (c.Fecha > CURDATE() OR (c.Fecha = CURDATE() AND c.Hora >= CURTIME()))
+ ORDER BY c.Fecha, c.Hora
+ LIMIT 1)
+"""
+
+
+def _recalcular(cursor, condicion, params):
+    cursor.execute(f"""
+    INSERT INTO Resumen_Paciente
+        (ID_Paciente, Total_Citas, Proxima_Cita, Ultimo_Diagnostico,
+         Tratamientos_Activos, Proximo_Fin_Tratamiento)
+    SELECT
+        p.ID_Paciente,
+        (SELECT COUNT(*) FROM Cita c WHERE c.ID_Paciente = p.ID_Paciente),
+        {PROXIMA_CITA_SQL.format(paciente='p.ID_Paciente')},
+        (SELECT MAX(d.Fecha) FROM Diagnóstico d
+         JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+         WHERE h.ID_Paciente = p.ID_Paciente),
+        (SELECT COUNT(*) FROM Tratamiento t
+         JOIN Diagnóstico d ON t.ID_Diagnóstico = d.ID_Diagnóstico
+         JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+         WHERE h.ID_Paciente = p.ID_Paciente
+           AND (t.Fecha_Fin IS NULL OR t.Fecha_Fin >= CURDATE())),
+        (SELECT MIN(t.Fecha_Fin) FROM Tratamiento t
+         JOIN Diagnóstico d ON t.ID_Diagnóstico = d.ID_Diagnóstico
+         JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+         WHERE h.ID_Paciente = p.ID_Paciente AND t.Fecha_Fin >= CURDATE())
+    FROM Paciente p
+    WHERE {condicion}
+    ON DUPLICATE KEY UPDATE
+        Total_Citas = VALUES(Total_Citas),
+        Proxima_Cita = VALUES(Proxima_Cita),
+        Ultimo_Diagnostico = VALUES(Ultimo_Diagnostico),
+        Tratamientos_Activos = VALUES(Tratamientos_Activos),
+        Proximo_Fin_Tratamiento = VALUES(Proximo_Fin_Tratamiento)
+    """, params)
+
+
+def recalcular_resumen(cursor, ids_paciente):
+    """Recalcula desde cero las filas de Resumen_Paciente de los pacientes dados.
+
+    Se ejecuta dentro de la transacción del llamador; no hace commit.
+    """
+    ids_paciente = [i for i in set(ids_paciente) if i is not None]
+    if not ids_paciente:
+        return
+    placeholders = ', '.join(['%s'] * len(ids_paciente))
+    _recalcular(cursor, f"p.ID_Paciente IN ({placeholders})", ids_paciente)
+
+
+def _sin_resumen(cursor, id_paciente):
+    """True si el paciente no tiene fila en Resumen_Paciente.
+
+    Un UPDATE que no cambia valores devuelve rowcount 0 salvo con FOUND_ROWS;
+    antes de recalcular todo se confirma que de verdad falta la fila.
+    """
+    if cursor.rowcount != 0:
+        return False
+    cursor.execute("SELECT 1 FROM Resumen_Paciente WHERE ID_Paciente = %s", (id_paciente,))
+    return cursor.fetchone() is None
+
+
+def ajustar_citas(cursor, id_paciente, delta):
+    """Suma `delta` al total de citas y vuelve a calcular la próxima cita.
+
+    Llamar después de insertar, borrar o modificar la cita en la misma transacción.
+    """
+    cursor.execute(f"""
+    UPDATE Resumen_Paciente r
+    SET r.Total_Citas = r.Total_Citas + %s,
+        r.Proxima_Cita = {PROXIMA_CITA_SQL.format(paciente='r.ID_Paciente')}
+    WHERE r.ID_Paciente = %s
+    """, (delta, id_paciente))
+    if _sin_resumen(cursor, id_paciente):
+        recalcular_resumen(cursor, [id_paciente])
+
+
+def registrar_diagnostico(cursor, id_paciente, fecha):
+    cursor.execute("""
+    UPDATE Resumen_Paciente
+    SET Ultimo_Diagnostico = GREATEST(COALESCE(Ultimo_Diagnostico, %s), %s)
+    WHERE ID_Paciente = %s
+    """, (fecha, fecha, id_paciente))
+    if _sin_resumen(cursor, id_paciente):
+        recalcular_resumen(cursor, [id_paciente])
+
+
+def registrar_tratamiento(cursor, id_diagnostico, fecha_fin):
+    """Cuenta un tratamiento nuevo si sigue activo (sin fin o con fin futuro)."""
+    if fecha_fin and str(fecha_fin) < date.today().strftime('%Y-%m-%d'):
+        return
+    cursor.execute("""
+    UPDATE Resumen_Paciente r
+    JOIN Historial_Médico h ON h.ID_Paciente = r.ID_Paciente
+    JOIN Diagnóstico d ON d.ID_Historial = h.ID_Historial
+    SET r.Tratamientos_Activos = r.Tratamientos_Activos + 1,
+        r.Proximo_Fin_Tratamiento = CASE
+            WHEN %s IS NULL THEN r.Proximo_Fin_Tratamiento
+            ELSE LEAST(COALESCE(r.Proximo_Fin_Tratamiento, %s), %s)
+        END
+    WHERE d.ID_Diagnóstico = %s
+    """, (fecha_fin, fecha_fin, fecha_fin, id_diagnostico))
+    if cursor.rowcount == 0:
+        _recalcular(cursor, """p.ID_Paciente = (
+            SELECT h.ID_Paciente FROM Diagnóstico d
+            JOIN Historial_Médico h ON d.ID_Historial = h.ID_Historial
+            WHERE d.ID_Diagnóstico = %s)""", (id_diagnostico,))
+
+
+@app.route('/pacientes/<int:paciente_id>/resumen', methods=['GET'])
+@jwt_required()
+@cross_origin()
+def get_resumen_paciente(paciente_id):
+    cursor = None
+    connection = None
+    try:
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+        
+        query = """
+        SELECT
+            ID_Paciente,
+            Total_Citas,
+            DATE_FORMAT(Proxima_Cita, '%Y-%m-%d %H:%i:%s') as Proxima_Cita,
+            DATE_FORMAT(Ultimo_Diagnostico, '%Y-%m-%d') as Ultimo_Diagnostico,
+            Tratamientos_Activos,
+            (Proxima_Cita < NOW() OR Proximo_Fin_Tratamiento < CURDATE()) AS vencido
+        FROM Resumen_Paciente
+        WHERE ID_Paciente = %s
+        """
+        cursor.execute(query, (paciente_id,))
+        resumen = cursor.fetchone()
+        
+        # Fila ausente (paciente nuevo) o con fechas ya pasadas: se recalcula solo este paciente
+        if not resumen or resumen['vencido']:
+            recalcular_resumen(cursor, [paciente_id])
+            connection.commit()
+            cursor.execute(query, (paciente_id,))
+            resumen = cursor.fetchone()
+            if not resumen:
+                return jsonify({'error': 'Patient not found'}), 404
+        
+        resumen.pop('vencido')
+        return jsonify({'resumen': resumen})
+        
+    except mysql.connector.Error as error:
+        app.logger.error(f"Database error in get_resumen_paciente: {error}")
+        return jsonify({'error': 'Database error'}), 500
+    except Exception as e:
+        app.logger.error(f"Unexpected error in get_resumen_paciente: {e}")
+        return jsonify({'error': 'Unexpected error'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@app.cli.command('reconstruir-resumen')
+@click.option('--lote', default=LOTE_RECONSTRUCCION, show_default=True,
+              help='Pacientes recalculados por transacción.')
+def reconstruir_resumen(lote):
+    """Recalcula Resumen_Paciente para todos los pacientes, por lotes."""
+    connection = conectar()
+    cursor = connection.cursor()
+    try:
+        ultimo_id = 0
+        total = 0
+        while True:
+            cursor.execute(
+                "SELECT ID_Paciente FROM Paciente WHERE ID_Paciente > %s ORDER BY ID_Paciente LIMIT %s",
+                (ultimo_id, lote)
+            )
+            ids = [fila[0] for fila in cursor.fetchall()]
+            if not ids:
+                break
+            recalcular_resumen(cursor, ids)
+            connection.commit()
+            ultimo_id = ids[-1]
+            total += len(ids)
+            click.echo(f"{total} pacientes recalculados")
+        click.echo(f"Resumen reconstruido: {total} pacientes")
+    finally:
+        cursor.close()
+        connection.close()
@@ -1,9 +1,142 @@
 from flask import Flask, request, jsonify
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, verify_jwt_in_request, get_jwt
 from flask_cors import cross_origin
 import mysql.connector
+import threading
+from functools import wraps
+import time
 from datetime import datetime
-from db import app, db_config
+from db import app
+from db.conexion import conectar
+from db.busqueda import normalizar
+from db.versiones import incrementar_version, leer_version
+
+
+def tipo_rol(nombre):
+    """'admin', 'paciente', 'medico' o None según el nombre del rol."""
+    nombre = normalizar(nombre)
+    if 'admin' in nombre:
+        return 'admin'
+    if 'paciente' in nombre:
+        return 'paciente'
+    if 'medico' in nombre or 'doctor' in nombre:
+        return 'medico'
+    return None
+
+
+class CatalogoRoles:
+    """Copia en memoria de la tabla Rol: {ID_Rol: {'ID_Rol', 'Nombre', 'tipo'}}.
+
+    Igual que el directorio de médicos, se recarga cuando este proceso la
+    invalida o cuando cambia la versión de 'Rol' en Version_Tabla, consultada
+    como máximo cada `intervalo` segundos.
+    """
+
+    def __init__(self, intervalo=5):
+        self._lock = threading.Lock()
+        self._intervalo = intervalo
+        self._roles = {}
+        self._version = None
+        self._ultimo_chequeo = 0
+
+    def invalidar(self):
+        with self._lock:
+            self._version = None
+
+    def requiere_consulta(self):
+        """True si hay que ir a la base de datos (sin cargar o intervalo vencido)."""
+        return self._version is None or time.monotonic() - self._ultimo_chequeo >= self._intervalo
+
+    def _vigente(self, cursor):
+        if self._version is None:
+            return False
+        if time.monotonic() - self._ultimo_chequeo < self._intervalo:
+            return True
+        self._ultimo_chequeo = time.monotonic()
+        return leer_version(cursor, 'Rol') == self._version
+
+    def asegurar_vigente(self, cursor):
+        with self._lock:
+            if self._vigente(cursor):
+                return
+            version = leer_version(cursor, 'Rol')
+            cursor.execute("SELECT ID_Rol, Nombre FROM Rol")
+            roles = {}
+            for fila in cursor.fetchall():
+                id_rol, nombre = (fila['ID_Rol'], fila['Nombre']) if isinstance(fila, dict) else fila
+                roles[id_rol] = {'ID_Rol': id_rol, 'Nombre': nombre, 'tipo': tipo_rol(nombre)}
+            self._roles = roles
+            self._version = version
+            self._ultimo_chequeo = time.monotonic()
+            app.logger.info(f"Role catalog loaded (version {version})")
+
+    def obtener(self, id_rol):
+        try:
+            return self._roles.get(int(id_rol))
+        except (TypeError, ValueError):
+            return None
+
+    def rol_de_claims(self, claims):
+        """Rol vigente del usuario del token, sin consultar la base de datos salvo al recargar.
+
+        Los tokens emitidos antes de incluir 'role_id' se resuelven por el nombre del rol.
+        """
+        if claims.get('role_id') is not None and self.requiere_consulta():
+            connection = None
+            cursor = None
+            try:
+                connection = conectar()
+                cursor = connection.cursor(dictionary=True)
+                self.asegurar_vigente(cursor)
+            except mysql.connector.Error as error:
+                # Con la base de datos caída se sigue usando la copia anterior
+                app.logger.error(f"Error refreshing role catalog: {error}")
+            finally:
+                if cursor:
+                    cursor.close()
+                if connection:
+                    connection.close()
+        rol = self.obtener(claims.get('role_id'))
+        if rol:
+            return rol
+        nombre = claims.get('role')
+        if not nombre:
+            return None
+        return {'ID_Rol': None, 'Nombre': nombre, 'tipo': tipo_rol(nombre)}
+
+
+catalogo_roles = CatalogoRoles()
+
+# Tipos de rol para requiere_rol
+ADMIN = 'admin'
+MEDICO = 'medico'
+PACIENTE = 'paciente'
+
+
+def requiere_rol(*permitidos, ubicaciones=None):
+    """Como @jwt_required(), pero además exige uno de los roles indicados.
+
+    Cada valor se compara con el tipo del rol ('admin', 'medico', 'paciente')
+    y con su nombre sin mayúsculas ni acentos. El rol sale de los claims del
+    token y del catálogo en memoria, no de una consulta por request.
+    `ubicaciones` cambia dónde se busca el token (p. ej. ['headers', 'query_string']
+    para EventSource, que no puede enviar Authorization).
+    """
+    permitidos = {normalizar(rol) for rol in permitidos}
+
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if request.method == 'OPTIONS':
+                return funcion(*args, **kwargs)
+            verify_jwt_in_request(locations=ubicaciones)
+            rol = catalogo_roles.rol_de_claims(get_jwt())
+            if not rol or not ({rol['tipo'], normalizar(rol['Nombre'])} & permitidos):
+                return jsonify({'error': 'Forbidden: insufficient role'}), 403
+            return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
 
 @app.route('/roles', methods=['GET'])
 @jwt_required()
@@ -12,7 +145,7 @@ def get_roles():
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
         
         query = "SELECT * FROM Rol ORDER BY Nombre"
@@ -30,7 +163,7 @@ def get_roles():
             connection.close()
 
 @app.route('/roles', methods=['POST'])
-
+@requiere_rol(ADMIN)
 @cross_origin()
 def create_rol():
     cursor = None
@@ -41,14 +174,17 @@ def create_rol():
         if not data or 'nombre' not in data:
             return jsonify({'error': 'Nombre del rol es requerido'}), 400
         
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
         
         query = "INSERT INTO Rol (Nombre) VALUES (%s)"
         cursor.execute(query, (data['nombre'],))
+        rol_id = cursor.lastrowid
+        incrementar_version(cursor, 'Rol')
         connection.commit()
+        catalogo_roles.invalidar()
         
-        return jsonify({'message': 'Rol creado exitosamente', 'id': cursor.lastrowid}), 201
+        return jsonify({'message': 'Rol creado exitosamente', 'id': rol_id}), 201
         
     except mysql.connector.Error as error:
         return jsonify({'error': f'Database error: {str(error)}'}), 500
@@ -3,11 +3,15 @@ from flask_jwt_extended import jwt_required
 from flask_cors import cross_origin
 import mysql.connector
 from datetime import datetime
-from db import app, db_config
+from db import app
+from db.conexion import conectar
+from roles import requiere_rol, ADMIN, MEDICO
+from resumenPaciente import registrar_tratamiento
+from medicamentos import paciente_de, invalidar_medicamentos_activos, verificar_interacciones
 
 
 @app.route('/tratamientos', methods=['POST'])
-@jwt_required()
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def create_tratamiento():
     cursor = None
@@ -23,9 +27,30 @@ def create_tratamiento():
         if missing_fields:
             return jsonify({'error': f'Missing fields: {", ".join(missing_fields)}'}), 400
         
-        connection = mysql.connector.connect(**db_config)
+        # Medicamentos opcionales, recetados junto con el tratamiento
+        medicamentos = data.get('medicamentos', [])
+        if not isinstance(medicamentos, list):
+            return jsonify({'error': 'medicamentos must be a list'}), 400
+        for i, medicamento in enumerate(medicamentos):
+            if not isinstance(medicamento, dict):
+                return jsonify({'error': f'medicamentos[{i}] must be an object'}), 400
+            missing_fields = [field for field in ('nombre', 'dosis') if field not in medicamento]
+            if missing_fields:
+                return jsonify({'error': f'Missing fields in medicamentos[{i}]: {", ".join(missing_fields)}'}), 400
+        
+        connection = conectar()
         cursor = connection.cursor()
         
+        paciente_id = paciente_de(cursor, id_diagnostico=data['id_diagnostico'])
+        if paciente_id is None:
+            return jsonify({'error': 'Diagnosis not found'}), 404
+        advertencias = []
+        if medicamentos:
+            # Las interacciones no bloquean la receta; vuelven como advertencias
+            advertencias = verificar_interacciones(
+                cursor, paciente_id, [medicamento['nombre'] for medicamento in medicamentos]
+            )
+        
         query = """
         INSERT INTO Tratamiento (Descripción, Fecha_Inicio, Fecha_Fin, ID_Diagnóstico)
         VALUES (%s, %s, %s, %s)
@@ -33,9 +58,87 @@ def create_tratamiento():
         
         values = (data['descripcion'], data['fecha_inicio'], data.get('fecha_fin'), data['id_diagnostico'])
         cursor.execute(query, values)
+        tratamiento_id = cursor.lastrowid
+        
+        medicamento_ids = []
+        if medicamentos:
+            cursor.executemany("""
+            INSERT INTO Medicamento (Nombre, Dosis, ID_Tratamiento)
+            VALUES (%s, %s, %s)
+            """, [(medicamento['nombre'], medicamento['dosis'], tratamiento_id) for medicamento in medicamentos])
+            # El tratamiento es nuevo, así que sus medicamentos son exactamente los insertados;
+            # los ids de un INSERT de varias filas crecen en el orden de las filas, aunque
+            # no sean consecutivos (auto_increment_increment > 1)
+            cursor.execute(
+                "SELECT ID_Medicamento FROM Medicamento WHERE ID_Tratamiento = %s ORDER BY ID_Medicamento",
+                (tratamiento_id,)
+            )
+            medicamento_ids = [fila[0] for fila in cursor.fetchall()]
+        
+        registrar_tratamiento(cursor, data['id_diagnostico'], data.get('fecha_fin'))
+        if medicamentos:
+            invalidar_medicamentos_activos(cursor, paciente_id)
         connection.commit()
         
-        return jsonify({'message': 'Tratamiento creado exitosamente', 'id': cursor.lastrowid}), 201
+        tratamiento = {
+            'ID_Tratamiento': tratamiento_id,
+            'Descripción': data['descripcion'],
+            'Fecha_Inicio': data['fecha_inicio'],
+            'Fecha_Fin': data.get('fecha_fin'),
+            'ID_Diagnóstico': data['id_diagnostico'],
+            'medicamentos': [
+                {
+                    'ID_Medicamento': medicamento_id,
+                    'Nombre': medicamento['nombre'],
+                    'Dosis': medicamento['dosis'],
+                    'ID_Tratamiento': tratamiento_id
+                }
+                for medicamento_id, medicamento in zip(medicamento_ids, medicamentos)
+            ]
+        }
+        return jsonify({
+            'message': 'Tratamiento creado exitosamente',
+            'id': tratamiento_id,
+            'tratamiento': tratamiento,
+            'advertencias': advertencias
+        }), 201
+        
+    except mysql.connector.Error as error:
+        # Sin commit no queda ni el tratamiento ni parte de sus medicamentos
+        if connection:
+            connection.rollback()
+        return jsonify({'error': f'Database error: {str(error)}'}), 500
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+@app.route('/tratamientos/diagnostico/<int:diagnostico_id>', methods=['GET'])
+@jwt_required()
+@cross_origin()
+def get_tratamientos_diagnostico(diagnostico_id):
+    cursor = None
+    connection = None
+    try:
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+        
+        query = """
+        SELECT 
+            t.ID_Tratamiento,
+            t.Descripción,
+            DATE_FORMAT(t.Fecha_Inicio, '%Y-%m-%d') as Fecha_Inicio,
+            DATE_FORMAT(t.Fecha_Fin, '%Y-%m-%d') as Fecha_Fin,
+            t.ID_Diagnóstico
+        FROM Tratamiento t
+        WHERE t.ID_Diagnóstico = %s
+        ORDER BY t.Fecha_Inicio DESC
+        """
+        cursor.execute(query, (diagnostico_id,))
+        tratamientos = cursor.fetchall()
+        
+        return jsonify({'tratamientos': tratamientos})
         
     except mysql.connector.Error as error:
         return jsonify({'error': f'Database error: {str(error)}'}), 500
@@ -2,17 +2,54 @@ from flask import Flask, request, jsonify
 from flask_jwt_extended import jwt_required
 from flask_cors import cross_origin
 import mysql.connector
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from db import app, db_config
+from db import app
+from db.conexion import conectar
 import bcrypt
+from db.lotes import cargar_en_lote
+from db.consultas import sentencia_update
+from db.versiones import incrementar_version
+from db.identidad import GENEROS, clave_identidad, buscar_duplicado
+from medicos import directorio_medicos
+from roles import catalogo_roles, requiere_rol, ADMIN, MEDICO
+
+CAMPOS_USUARIO = {
+    'nombre': 'Nombre',
+    'correo': 'Correo',
+    'password': 'Contraseña',
+    'id_rol': 'ID_Rol'
+}
+
+# Máximo de usuarios por llamada a POST /usuarios/lote
+LOTE_USUARIOS_MAX = 5000
+CAMPOS_LOTE = {
+    'usuario': ['nombre', 'correo', 'password', 'id_rol'],
+    'paciente': ['fecha_nacimiento', 'genero', 'telefono'],
+    'medico': ['especialidad', 'telefono']
+}
+
 def hash_password(password):
     salt = bcrypt.gensalt() 
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
+# bcrypt es costoso a propósito; el alta masiva lo reparte en un pool de procesos
+_pool_hash = None
+_pool_lock = threading.Lock()
+
+def pool_hash():
+    global _pool_hash
+    with _pool_lock:
+        if _pool_hash is None:
+            _pool_hash = ProcessPoolExecutor()
+        return _pool_hash
+
 
 
 @app.route('/usuarios', methods=['POST'])
+@requiere_rol(ADMIN)
 @cross_origin()
 def create_usuario():
     cursor = None
@@ -32,7 +69,7 @@ def create_usuario():
             app.logger.error(f"Missing required fields: {missing_fields}")
             return jsonify({'error': f'Missing required fields: {", ".join(missing_fields)}'}), 400
 
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
 
         # Start transaction
@@ -63,15 +100,24 @@ def create_usuario():
             if missing_paciente:
                 return jsonify({'error': f'Missing required fields for paciente: {", ".join(missing_paciente)}'}), 400
 
+            clave = clave_identidad(user_data['nombre'], user_data['fecha_nacimiento'], user_data['telefono'])
+            existente = buscar_duplicado(cursor, clave)
+            if existente:
+                return jsonify({
+                    'error': 'Paciente ya registrado',
+                    'id_existente': existente
+                }), 409
+
             paciente_query = """
-            INSERT INTO Paciente (Nombre, Fecha_Nacimiento, Género, Teléfono)
-            VALUES (%s, %s, %s, %s)
+            INSERT INTO Paciente (Nombre, Fecha_Nacimiento, Género, Teléfono, Clave_Identidad)
+            VALUES (%s, %s, %s, %s, %s)
             """
             paciente_values = (
                 user_data['nombre'],
                 user_data['fecha_nacimiento'],
                 user_data['genero'],
-                user_data['telefono']
+                user_data['telefono'],
+                clave
             )
             
             cursor.execute(paciente_query, paciente_values)
@@ -104,6 +150,7 @@ def create_usuario():
             
             cursor.execute(medico_query, medico_values)
             id_medico = cursor.lastrowid
+            incrementar_version(cursor, 'Médico')
             
             app.logger.info(f"Created Médico record with ID: {id_medico}")
 
@@ -133,6 +180,8 @@ def create_usuario():
 
         # Commit transaction
         connection.commit()
+        if id_medico:
+            directorio_medicos.invalidar()
 
         app.logger.info(f"User {user_data['nombre']} created successfully with ID: {usuario_id}")
         
@@ -179,14 +228,228 @@ def create_usuario():
             app.logger.debug("Cleanup error details:", exc_info=True)
 
 
+@app.route('/usuarios/lote', methods=['POST'])
+@requiere_rol(ADMIN)
+@cross_origin()
+def create_usuarios_lote():
+    cursor = None
+    connection = None
+    try:
+        data = request.get_json(silent=True)
+        usuarios = data.get('usuarios') if isinstance(data, dict) else data
+        if not isinstance(usuarios, list) or not usuarios:
+            return jsonify({'error': 'Expected a non-empty list of usuarios'}), 400
+        if len(usuarios) > LOTE_USUARIOS_MAX:
+            return jsonify({'error': f'At most {LOTE_USUARIOS_MAX} usuarios per request'}), 400
+
+        resultados = [None] * len(usuarios)
+
+        def rechazar(fila, mensaje):
+            resultados[fila] = {'fila': fila, 'error': mensaje}
+
+        validos = []
+        for fila, usuario in enumerate(usuarios):
+            if not isinstance(usuario, dict):
+                rechazar(fila, 'Invalid row format')
+                continue
+            faltantes = [campo for campo in CAMPOS_LOTE['usuario'] if not usuario.get(campo)]
+            if faltantes:
+                rechazar(fila, f'Missing required fields: {", ".join(faltantes)}')
+                continue
+            # Un mismo correo con otras mayúsculas o espacios cuenta como repetido
+            usuario['correo'] = str(usuario['correo']).strip().lower()
+            validos.append(fila)
+
+        connection = conectar()
+        cursor = connection.cursor(dictionary=True)
+
+        # Solo lecturas antes de hashear: el rol sale del catálogo en memoria
+        catalogo_roles.asegurar_vigente(cursor)
+        tipos = {}
+        pendientes = []
+        for fila in validos:
+            usuario = usuarios[fila]
+            rol = catalogo_roles.obtener(usuario['id_rol'])
+            if not rol:
+                rechazar(fila, 'Rol no encontrado')
+                continue
+            faltantes = [campo for campo in CAMPOS_LOTE.get(rol['tipo'], []) if not usuario.get(campo)]
+            if faltantes:
+                rechazar(fila, f'Missing required fields for {rol["tipo"]}: {", ".join(faltantes)}')
+                continue
+            if rol['tipo'] == 'paciente':
+                try:
+                    datetime.strptime(str(usuario['fecha_nacimiento']), '%Y-%m-%d')
+                except ValueError:
+                    rechazar(fila, f"Invalid fecha_nacimiento: {usuario['fecha_nacimiento']}")
+                    continue
+                if usuario['genero'] not in GENEROS:
+                    rechazar(fila, f"Invalid genero: {usuario['genero']} (expected one of: {', '.join(GENEROS)})")
+                    continue
+            tipos[fila] = rol['tipo']
+            if rol['tipo'] == 'paciente':
+                usuario['clave_identidad'] = clave_identidad(
+                    usuario['nombre'], usuario['fecha_nacimiento'], usuario['telefono']
+                )
+            pendientes.append(fila)
+
+        # Correos y pacientes repetidos, en la base de datos o dentro del mismo lote
+        correos_existentes = {correo.lower() for correo in cargar_en_lote(
+            cursor, "SELECT Correo FROM Usuario WHERE Correo IN ({ids})",
+            [usuarios[fila]['correo'] for fila in pendientes], 'Correo'
+        )}
+        pacientes_existentes = cargar_en_lote(
+            cursor, "SELECT ID_Paciente, Clave_Identidad FROM Paciente WHERE Clave_Identidad IN ({ids})",
+            [usuarios[fila].get('clave_identidad') for fila in pendientes], 'Clave_Identidad'
+        )
+        vistos = set()
+        validos, pendientes = pendientes, []
+        for fila in validos:
+            usuario = usuarios[fila]
+            clave = usuario.get('clave_identidad')
+            if usuario['correo'] in correos_existentes or ('correo', usuario['correo']) in vistos:
+                rechazar(fila, 'El correo ya está registrado')
+            elif clave and (clave in pacientes_existentes or ('paciente', clave) in vistos):
+                existente = pacientes_existentes.get(clave)
+                rechazar(fila, 'Paciente ya registrado')
+                if existente:
+                    resultados[fila]['id_existente'] = existente[0]['ID_Paciente']
+            else:
+                pendientes.append(fila)
+            vistos.add(('correo', usuario['correo']))
+            if clave:
+                vistos.add(('paciente', clave))
+
+        # Las lecturas abrieron una transacción implícita (autocommit apagado); se
+        # cierra para no retener el snapshot mientras se hashea y poder abrir la de escritura
+        connection.rollback()
+
+        # Hash en paralelo, sin ninguna transacción abierta
+        hashes = list(pool_hash().map(
+            hash_password, [usuarios[fila]['password'] for fila in pendientes], chunksize=16
+        ))
+
+        creados = 0
+        if pendientes:
+            connection.start_transaction()
+            hoy = datetime.now().date()
+            pacientes = [fila for fila in pendientes if tipos[fila] == 'paciente']
+            medicos = [fila for fila in pendientes if tipos[fila] == 'medico']
+            # Los ids generados no se deducen de lastrowid (no son consecutivos con
+            # auto_increment_increment > 1): se releen por clave natural en la transacción
+            ids_paciente = {}
+            if pacientes:
+                cursor.executemany("""
+                INSERT INTO Paciente (Nombre, Fecha_Nacimiento, Género, Teléfono, Clave_Identidad)
+                VALUES (%s, %s, %s, %s, %s)
+                """, [(usuarios[fila]['nombre'], usuarios[fila]['fecha_nacimiento'], usuarios[fila]['genero'],
+                       usuarios[fila]['telefono'], usuarios[fila]['clave_identidad']) for fila in pacientes])
+                # lastrowid es el primer id del INSERT; los pacientes previos con la misma clave
+                # ya se rechazaron y, de haberlos, tienen ids menores
+                nuevos = cargar_en_lote(
+                    cursor,
+                    "SELECT ID_Paciente, Clave_Identidad FROM Paciente "
+                    f"WHERE ID_Paciente >= {int(cursor.lastrowid)} AND Clave_Identidad IN ({{ids}})",
+                    [usuarios[fila]['clave_identidad'] for fila in pacientes], 'Clave_Identidad'
+                )
+                ids_paciente = {
+                    fila: min(p['ID_Paciente'] for p in nuevos[usuarios[fila]['clave_identidad']])
+                    for fila in pacientes
+                }
+                cursor.executemany(
+                    "INSERT INTO Historial_Médico (ID_Paciente, Fecha_Creación) VALUES (%s, %s)",
+                    [(ids_paciente[fila], hoy) for fila in pacientes]
+                )
+            ids_medico = {}
+            if medicos:
+                datos_medico = [(usuarios[fila]['nombre'], usuarios[fila]['especialidad'], usuarios[fila]['telefono'])
+                                for fila in medicos]
+                cursor.executemany("""
+                INSERT INTO Médico (Nombre, Especialidad, Teléfono)
+                VALUES (%s, %s, %s)
+                """, datos_medico)
+                # Médico no tiene clave única: se releen desde lastrowid por (nombre,
+                # especialidad, teléfono) y los repetidos se asignan en orden de id,
+                # que es el orden del INSERT
+                nuevos = cargar_en_lote(
+                    cursor,
+                    "SELECT ID_Médico, Nombre, Especialidad, Teléfono FROM Médico "
+                    f"WHERE ID_Médico >= {int(cursor.lastrowid)} AND Teléfono IN ({{ids}}) ORDER BY ID_Médico",
+                    [usuarios[fila]['telefono'] for fila in medicos], 'Teléfono'
+                )
+                asignados = set()
+                for fila, (nombre, especialidad, telefono) in zip(medicos, datos_medico):
+                    ids_medico[fila] = next(
+                        m['ID_Médico'] for m in nuevos[telefono]
+                        if m['ID_Médico'] not in asignados
+                        and (m['Nombre'], m['Especialidad']) == (nombre, especialidad)
+                    )
+                    asignados.add(ids_medico[fila])
+                incrementar_version(cursor, 'Médico')
+            cursor.executemany("""
+            INSERT INTO Usuario (Nombre, Correo, Contraseña, ID_Rol, ID_Paciente, ID_Doctor)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """, [(usuarios[fila]['nombre'], usuarios[fila]['correo'], hashed, usuarios[fila]['id_rol'],
+                   ids_paciente.get(fila), ids_medico.get(fila)) for fila, hashed in zip(pendientes, hashes)])
+            # Los correos repetidos se rechazaron arriba, así que identifican al usuario
+            ids_usuario = cargar_en_lote(
+                cursor, "SELECT ID_Usuario, Correo FROM Usuario WHERE Correo IN ({ids})",
+                [usuarios[fila]['correo'] for fila in pendientes], 'Correo'
+            )
+            connection.commit()
+            if medicos:
+                directorio_medicos.invalidar()
+
+            for fila in pendientes:
+                resultados[fila] = {
+                    'fila': fila,
+                    'usuario_id': ids_usuario[usuarios[fila]['correo']][0]['ID_Usuario'],
+                    'correo': usuarios[fila]['correo'],
+                    'tipo': tipos[fila]
+                }
+                if fila in ids_paciente:
+                    resultados[fila]['id_paciente'] = ids_paciente[fila]
+                if fila in ids_medico:
+                    resultados[fila]['id_medico'] = ids_medico[fila]
+            creados = len(pendientes)
+
+        app.logger.info(f"Bulk user creation: {creados} created, {len(usuarios) - creados} rejected")
+        return jsonify({
+            'success': creados == len(usuarios),
+            'creados': creados,
+            'rechazados': len(usuarios) - creados,
+            'resultados': resultados
+        }), 201 if creados else 400
+
+    except mysql.connector.Error as error:
+        if connection:
+            connection.rollback()
+        app.logger.error(f"Database error in create_usuarios_lote: {error}")
+        return jsonify({'error': f'Database error: {str(error)}'}), 500
+
+    except Exception as e:
+        if connection:
+            connection.rollback()
+        app.logger.error(f"Unexpected error in create_usuarios_lote: {str(e)}")
+        app.logger.debug("Error details:", exc_info=True)
+        return jsonify({'error': f'Unexpected error occurred: {str(e)}'}), 500
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
 # Helper endpoint to get user details with related data
 @app.route('/usuarios/<int:user_id>', methods=['GET'])
+@jwt_required()
 @cross_origin()
 def get_usuario(user_id):
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor(dictionary=True)
 
         # Get user basic info
@@ -238,6 +501,7 @@ def get_usuario(user_id):
 
 # Endpoint to update user relationships (assign patient to doctor, etc.)
 @app.route('/usuarios/<int:user_id>/assign-doctor', methods=['PUT'])
+@requiere_rol(ADMIN, MEDICO)
 @cross_origin()
 def assign_doctor_to_patient(user_id):
     cursor = None
@@ -248,7 +512,7 @@ def assign_doctor_to_patient(user_id):
         if not data or 'id_doctor' not in data:
             return jsonify({'error': 'ID del doctor requerido'}), 400
 
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
 
         # Verify patient user exists and has a paciente record
@@ -307,7 +571,7 @@ def assign_doctor_to_patient(user_id):
             app.logger.error(f"Error closing database connection: {str(cleanup_error)}")
             
 @app.route('/usuarios/<int:usuario_id>', methods=['PUT'])
-@jwt_required()
+@requiere_rol(ADMIN)
 @cross_origin()
 def update_usuario(usuario_id):
     cursor = None
@@ -318,7 +582,7 @@ def update_usuario(usuario_id):
         if not user_data:
             return jsonify({'error': 'No data provided'}), 400
         
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
         
         # Verificar que el usuario existe
@@ -326,43 +590,30 @@ def update_usuario(usuario_id):
         if cursor.fetchone()[0] == 0:
             return jsonify({'error': 'Usuario no encontrado'}), 404
         
-        # Construir query dinámicamente según los campos proporcionados
-        update_fields = []
-        values = []
+        # Validar los campos que lo requieren y armar el UPDATE con los presentes
+        cambios = dict(user_data)
         
-        if 'nombre' in user_data:
-            update_fields.append("Nombre = %s")
-            values.append(user_data['nombre'])
-            
         if 'correo' in user_data:
             # Verificar que el correo no esté duplicado por otro usuario
             cursor.execute("SELECT COUNT(*) FROM Usuario WHERE Correo = %s AND ID_Usuario != %s", 
                          (user_data['correo'], usuario_id))
             if cursor.fetchone()[0] > 0:
                 return jsonify({'error': 'El correo ya está registrado por otro usuario'}), 409
-            update_fields.append("Correo = %s")
-            values.append(user_data['correo'])
             
         if 'password' in user_data:
-            hashed_password = hash_password(user_data['password'])
-            update_fields.append("Contraseña = %s")
-            values.append(hashed_password)
+            cambios['password'] = hash_password(user_data['password'])
             
         if 'id_rol' in user_data:
             # Verificar que el rol existe
             cursor.execute("SELECT COUNT(*) FROM Rol WHERE ID_Rol = %s", (user_data['id_rol'],))
             if cursor.fetchone()[0] == 0:
                 return jsonify({'error': 'Rol no encontrado'}), 404
-            update_fields.append("ID_Rol = %s")
-            values.append(user_data['id_rol'])
         
-        if not update_fields:
+        update = sentencia_update('Usuario', CAMPOS_USUARIO, cambios, 'ID_Usuario', usuario_id)
+        if not update:
             return jsonify({'error': 'No hay campos para actualizar'}), 400
         
-        values.append(usuario_id)
-        query = f"UPDATE Usuario SET {', '.join(update_fields)} WHERE ID_Usuario = %s"
-        
-        cursor.execute(query, values)
+        cursor.execute(*update)
         connection.commit()
         
         return jsonify({'message': 'Usuario actualizado exitosamente'})
@@ -376,13 +627,13 @@ def update_usuario(usuario_id):
             connection.close()
 
 @app.route('/usuarios/<int:usuario_id>', methods=['DELETE'])
-@jwt_required()
+@requiere_rol(ADMIN)
 @cross_origin()
 def delete_usuario(usuario_id):
     cursor = None
     connection = None
     try:
-        connection = mysql.connector.connect(**db_config)
+        connection = conectar()
         cursor = connection.cursor()
         
         # Verificar que el usuario existe